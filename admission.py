@@ -0,0 +1,201 @@
+"""
+CipherMesh Admission Control
+
+Size-aware scheduling in front of the cipher endpoints. Each request has
+an estimated cost (input characters x detail weight). Cheap requests take
+the fast lane and run at once; expensive ones take the slow lane, where at
+most `slow_workers` run at a time and the rest wait in FIFO order. When
+the queue or the slow lane's cost budget is full, requests are rejected
+with an Overloaded error carrying a Retry-After estimate instead of piling
+up behind the work already admitted.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+FAST = 'fast'
+SLOW = 'slow'
+
+
+class Overloaded(Exception):
+    """A request was not admitted: `status` is 429 (queue full) or 503 (over budget or timed out)."""
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One admitted request: its lane, cost and how long it waited for a slot."""
+    __slots__ = ('lane', 'cost', 'queued', 'started', 'released')
+
+    def __init__(self, lane, cost):
+        self.lane = lane
+        self.cost = cost
+        self.queued = self.started = time.monotonic()
+        self.released = False
+
+    @property
+    def wait(self):
+        return self.started - self.queued
+
+
+class AdmissionController:
+    """
+    Two-lane admission for requests of estimated `cost`.
+
+    Costs below slow_cost take the fast lane and are never queued. The slow
+    lane runs at most slow_workers requests at once. Up to max_queue more
+    wait for a slot, for at most queue_timeout seconds. A request is turned
+    away with 429 when the queue is full, and with 503 when the slow lane's
+    running plus queued cost would exceed max_cost or its wait times out.
+    One request costing more than max_cost is still admitted when the slow
+    lane is otherwise empty.
+    """
+    # Weight of the newest completion in the slow lane's throughput estimate
+    THROUGHPUT_SMOOTHING = 0.2
+
+    def __init__(self, slow_cost=1 << 18, slow_workers=2, max_queue=16, max_cost=1 << 26,
+                 queue_timeout=10.0, enabled=True):
+        self.slow_cost = slow_cost
+        self.slow_workers = slow_workers
+        self.max_queue = max_queue
+        self.max_cost = max_cost
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._running = 0
+        self._fast_running = 0
+        # cost of running plus queued slow-lane requests
+        self._cost = 0
+        # slow-lane cost completed per second, once anything has completed
+        self._throughput = None
+        self.admitted = {FAST: 0, SLOW: 0}
+        self.rejected = {429: 0, 503: 0}
+        self.wait_total = self.wait_max = 0.0
+
+    def lane(self, cost):
+        return SLOW if self.enabled and cost >= self.slow_cost else FAST
+
+    def retry_after(self):
+        """Seconds until the slow lane has likely drained its current work (at least 1)."""
+        if not self._throughput:
+            return 1
+        return max(1, math.ceil(self._cost / self._throughput))
+
+    def _reject(self, status, message):
+        self.rejected[status] += 1
+        raise Overloaded(status, self.retry_after(), message)
+
+    def acquire(self, cost):
+        """Admit a request of `cost`, waiting for a slow-lane slot if needed.
+
+        Returns a Ticket to pass to release(); raises Overloaded when the
+        request is not admitted.
+        """
+        ticket = Ticket(self.lane(cost), cost)
+        with self._cond:
+            if ticket.lane == FAST:
+                self._fast_running += 1
+                self.admitted[FAST] += 1
+                return ticket
+            if len(self._waiting) >= self.max_queue and (self._waiting or self._running >= self.slow_workers):
+                self._reject(429, f'Too many large requests queued ({len(self._waiting)})')
+            if self._cost and self._cost + cost > self.max_cost:
+                self._reject(503, 'Server is at capacity for large requests')
+
+            self._cost += cost
+            self._waiting.append(ticket)
+            deadline = ticket.queued + self.queue_timeout
+            while self._waiting[0] is not ticket or self._running >= self.slow_workers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._cost -= cost
+                    # the next request in line may be able to start now
+                    self._cond.notify_all()
+                    self._reject(503, f'Timed out after {self.queue_timeout:g} s waiting for a worker')
+                self._cond.wait(remaining)
+            self._waiting.popleft()
+            self._running += 1
+            ticket.started = time.monotonic()
+            self.admitted[SLOW] += 1
+            self.wait_total += ticket.wait
+            self.wait_max = max(self.wait_max, ticket.wait)
+            # slots may remain for the request now at the head of the queue
+            self._cond.notify_all()
+        return ticket
+
+    def release(self, ticket):
+        """Finish an admitted request; calling it again is a no-op."""
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.lane == FAST:
+                self._fast_running -= 1
+                return
+            self._running -= 1
+            self._cost -= ticket.cost
+            elapsed = time.monotonic() - ticket.started
+            if elapsed > 0:
+                rate = ticket.cost / elapsed
+                self._throughput = rate if self._throughput is None else (
+                    self.THROUGHPUT_SMOOTHING * rate + (1 - self.THROUGHPUT_SMOOTHING) * self._throughput)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost):
+        """Context manager around acquire()/release(), yielding the Ticket."""
+        ticket = self.acquire(cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._cond:
+            admitted_slow = self.admitted[SLOW]
+            return {
+                'enabled': self.enabled,
+                'fast': {'running': self._fast_running, 'admitted': self.admitted[FAST]},
+                'slow': {
+                    'running': self._running,
+                    'queued': len(self._waiting),
+                    'cost': self._cost,
+                    'admitted': admitted_slow,
+                    'wait_avg': self.wait_total / admitted_slow if admitted_slow else 0.0,
+                    'wait_max': self.wait_max,
+                    'throughput': self._throughput or 0.0,
+                },
+                'rejected': {str(status): count for status, count in self.rejected.items()},
+                'limits': {'slow_cost': self.slow_cost, 'slow_workers': self.slow_workers,
+                           'max_queue': self.max_queue, 'max_cost': self.max_cost,
+                           'queue_timeout': self.queue_timeout},
+            }
+
+    def prometheus(self):
+        """Queue gauges and rejection counters in the Prometheus text format."""
+        stats = self.stats()
+        lines = [
+            '# HELP ciphermesh_admission_running Requests running, per lane.',
+            '# TYPE ciphermesh_admission_running gauge',
+            f'ciphermesh_admission_running{{lane="fast"}} {stats["fast"]["running"]}',
+            f'ciphermesh_admission_running{{lane="slow"}} {stats["slow"]["running"]}',
+            '# HELP ciphermesh_admission_queue_depth Slow-lane requests waiting for a worker.',
+            '# TYPE ciphermesh_admission_queue_depth gauge',
+            f'ciphermesh_admission_queue_depth {stats["slow"]["queued"]}',
+            '# HELP ciphermesh_admission_queued_cost Estimated cost of running and queued slow-lane requests.',
+            '# TYPE ciphermesh_admission_queued_cost gauge',
+            f'ciphermesh_admission_queued_cost {stats["slow"]["cost"]}',
+            '# HELP ciphermesh_admission_rejected_total Requests turned away, per HTTP status.',
+            '# TYPE ciphermesh_admission_rejected_total counter',
+        ]
+        lines.extend(f'ciphermesh_admission_rejected_total{{status="{status}"}} {count}'
+                     for status, count in stats['rejected'].items())
+        return '\n'.join(lines) + '\n'
@@ -1,60 +1,549 @@
-from flask import Flask, render_template, request, jsonify
-from cipher_logic import CipherMesh, SetLayer, FunctionLayer, GraphLayer
+import atexit
+import json
+import threading
+import time
+from contextlib import contextmanager
 
-app = Flask(__name__)
+from flask import Blueprint, Flask, current_app, g, render_template, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+from cipher_logic import (CipherMesh, SetLayer, FunctionLayer, GraphLayer, CipherKey, KeyCache, TraceColumns,
+                          create_executor, keyed_call, DETAIL_LEVELS, DETAIL_FULL, DETAIL_NONE,
+                          TRACE_FORMATS, TRACE_ROWS)
+from admission import AdmissionController, Overloaded
+from metrics import REGISTRY as METRICS, Registry
+from result_cache import ResultCache, make_key
 
-# Initialize cipher system
-cipher_mesh = CipherMesh()
+DEFAULT_CONFIG = {
+    # Largest accepted request body (413 above it)
+    'MAX_CONTENT_LENGTH': 64 * 1024 * 1024,
+    # Limits protecting the worker from oversized batch requests
+    'MAX_BATCH_SIZE': 1000,
+    'MAX_BATCH_BYTES': 16 * 1024 * 1024,
+    # Number of compiled per-tenant keys kept in memory
+    'KEY_CACHE_SIZE': 128,
+    # Worker processes for large payloads; None keeps all work in this process
+    'CIPHER_WORKERS': None,
+    # Requests whose estimated cost reaches this run in the worker pool, so
+    # they don't hold the GIL while small requests wait
+    'OFFLOAD_THRESHOLD': 1 << 20,
+    # Cache of serialized results for repeated payloads (0 entries disables it)
+    'RESULT_CACHE_ENTRIES': 4096,
+    'RESULT_CACHE_BYTES': 64 * 1024 * 1024,
+    'RESULT_CACHE_MAX_ENTRY_BYTES': 1024 * 1024,
+    'RESULT_CACHE_TTL': 300,
+    # SQLite file shared by all server processes; None keeps the cache per process
+    'RESULT_CACHE_PATH': None,
+    # Per-layer/per-endpoint counters and latency histograms served at /metrics
+    'METRICS_ENABLED': True,
+    # Admission control: requests whose estimated cost reaches ADMISSION_SLOW_COST
+    # share ADMISSION_SLOW_WORKERS slots; up to ADMISSION_MAX_QUEUE more wait for
+    # ADMISSION_QUEUE_TIMEOUT seconds (429 when the queue is full, 503 when the
+    # queued cost would exceed ADMISSION_MAX_COST or the wait times out)
+    'ADMISSION_ENABLED': True,
+    'ADMISSION_SLOW_COST': 1 << 18,
+    'ADMISSION_SLOW_WORKERS': 2,
+    'ADMISSION_MAX_QUEUE': 16,
+    'ADMISSION_MAX_COST': 1 << 26,
+    'ADMISSION_QUEUE_TIMEOUT': 10,
+}
 
-@app.route('/')
+# Relative cost per input character at each detail level
+DETAIL_COST = {'none': 1, 'summary': 2, 'full': 40}
+# The same for columnar traces, which skip the per-step dicts and formulas
+COLUMNS_DETAIL_COST = {'none': 1, 'summary': 2, 'full': 4}
+
+NDJSON = 'application/x-ndjson'
+# Streaming counterparts of the CipherMesh *_with_details methods
+STREAM_METHODS = {
+    'encrypt_with_details': 'iter_encrypt_details',
+    'decrypt_with_details': 'iter_decrypt_details',
+}
+# Batch counterparts used for detail=none batches
+BATCH_METHODS = {
+    'encrypt_with_details': 'encrypt_many',
+    'decrypt_with_details': 'decrypt_many',
+}
+
+bp = Blueprint('ciphermesh', __name__)
+
+
+class CipherJSONProvider(DefaultJSONProvider):
+    """Default JSON provider that also writes columnar traces in their compact form."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, TraceColumns):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+
+class CipherService:
+    """Per-app cipher state: shared cipher, key cache and optional process pool."""
+
+    def __init__(self, config):
+        self.config = config
+        self._executor = None
+        self._lock = threading.Lock()
+        self.cipher_mesh = CipherMesh()
+        # endpoint metrics go to the process registry (next to the layer and
+        # pipeline series) unless this app turned them off
+        self.metrics = METRICS if config['METRICS_ENABLED'] else Registry(enabled=False)
+        self.key_cache = KeyCache(maxsize=config['KEY_CACHE_SIZE'])
+        self.result_cache = ResultCache(
+            max_entries=config['RESULT_CACHE_ENTRIES'],
+            max_bytes=config['RESULT_CACHE_BYTES'],
+            ttl=config['RESULT_CACHE_TTL'],
+            max_entry_bytes=config['RESULT_CACHE_MAX_ENTRY_BYTES'],
+            shared_path=config['RESULT_CACHE_PATH'])
+        self.admission = AdmissionController(
+            slow_cost=config['ADMISSION_SLOW_COST'],
+            slow_workers=config['ADMISSION_SLOW_WORKERS'],
+            max_queue=config['ADMISSION_MAX_QUEUE'],
+            max_cost=config['ADMISSION_MAX_COST'],
+            queue_timeout=config['ADMISSION_QUEUE_TIMEOUT'],
+            enabled=config['ADMISSION_ENABLED'])
+
+    @property
+    def executor(self):
+        """Process pool, created on first use (after any server fork)."""
+        if self._executor is None and self.config['CIPHER_WORKERS']:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = create_executor(self.config['CIPHER_WORKERS'])
+                    # graceful shutdown: finish queued pool work when the process exits
+                    atexit.register(self.shutdown)
+                    self.cipher_mesh = CipherMesh(executor=self._executor)
+                    self.key_cache.executor = self._executor
+        return self._executor
+
+    def cipher_for(self, data):
+        """Return the shared cipher, or the cached one for the request's 'key'."""
+        if data.get('key') is None:
+            return self.cipher_mesh
+        return self.key_cache.get(CipherKey.from_dict(data['key']))
+
+    @staticmethod
+    def cost(length, detail, trace_format=TRACE_ROWS):
+        """Estimated cost of running `length` characters at a detail level."""
+        return length * (DETAIL_COST if trace_format == TRACE_ROWS else COLUMNS_DETAIL_COST)[detail]
+
+    def run(self, cipher, method, text, detail, trace_format=TRACE_ROWS):
+        """Run cipher.<method>(text, detail=detail, trace_format=...), offloading expensive calls."""
+        executor = self.executor
+        if executor is not None and self.cost(len(text), detail, trace_format) >= self.config['OFFLOAD_THRESHOLD']:
+            return executor.submit(keyed_call, cipher.key, method, text, detail=detail,
+                                   trace_format=trace_format).result()
+        return getattr(cipher, method)(text, detail=detail, trace_format=trace_format)
+
+    def shutdown(self):
+        """Let in-flight pool work finish, then stop the workers."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+                atexit.unregister(self.shutdown)
+
+
+def _service():
+    return current_app.extensions['ciphermesh']
+
+def _metrics():
+    return _service().metrics
+
+def _acquire(cost):
+    """Admit a request of estimated `cost` (or raise Overloaded), recording its queue wait."""
+    service = _service()
+    ticket = service.admission.acquire(cost)
+    if service.metrics.enabled:
+        service.metrics.observe('queue', ticket.lane, ticket.wait)
+    return ticket
+
+@contextmanager
+def _admitted(cost):
+    """Hold an admission slot for `cost` around a block."""
+    ticket = _acquire(cost)
+    try:
+        yield ticket
+    finally:
+        _service().admission.release(ticket)
+
+@bp.before_app_request
+def _start_timer():
+    if _metrics().enabled:
+        g.metrics_start = time.perf_counter()
+
+@bp.after_app_request
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None and request.endpoint:
+        _metrics().observe('endpoint', request.endpoint, time.perf_counter() - start,
+                           request.content_length or 0, response.calculate_content_length() or 0)
+    return response
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    limit = current_app.config['MAX_CONTENT_LENGTH']
+    return jsonify({'error': f'Request body exceeds {limit} bytes'}), 413
+
+@bp.app_errorhandler(Overloaded)
+def overloaded(e):
+    _metrics().error('admission', request.endpoint)
+    return jsonify({'error': str(e), 'retry_after': e.retry_after}), e.status, {'Retry-After': str(e.retry_after)}
+
+@bp.route('/')
 def index():
     """Main page route."""
     return render_template('index.html')
 
-@app.route('/api/encrypt', methods=['POST'])
-def encrypt():
-    """Encryption API endpoint."""
+def _run_single(field, method, result_key):
+    """Handle a single encrypt/decrypt request, serving repeats from the result cache."""
     try:
-        data = request.get_json()
-        plaintext = data.get('plaintext', '')
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        text = data.get(field, '')
         
-        if not plaintext:
-            return jsonify({'error': 'Plaintext is required'}), 400
+        if not text:
+            return jsonify({'error': f'{field.capitalize()} is required'}), 400
+
+        detail = data.get('detail', DETAIL_FULL)
+        if detail not in DETAIL_LEVELS:
+            return jsonify({'error': f"detail must be one of {', '.join(DETAIL_LEVELS)}"}), 400
+        trace_format = data.get('trace_format', TRACE_ROWS)
+        if trace_format not in TRACE_FORMATS:
+            return jsonify({'error': f"trace_format must be one of {', '.join(TRACE_FORMATS)}"}), 400
         
-        # Get detailed encryption process
-        result = cipher_mesh.encrypt_with_details(plaintext)
+        service = _service()
+        try:
+            cipher = service.cipher_for(data)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid key: {e}'}), 400
+
+        cost = service.cost(len(text), detail, trace_format)
+        if request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+            return _stream_trace(cipher, method, text, detail, trace_format, cost)
+
+        cache = service.result_cache
+        cache_key = make_key(f'{method}/{trace_format}', cipher.key, detail, text) if cache.enabled else None
+        body = cache.get(cache_key) if cache_key else None
+        if body is not None:
+            return current_app.response_class(body, mimetype='application/json')
         
-        return jsonify({
-            'success': True,
-            'result': result['ciphertext'],
-            'plaintext': plaintext,
-            'details': result['details']
-        })
+        # serializing a large trace costs as much as building it, so both hold the slot
+        with _admitted(cost):
+            result = service.run(cipher, method, text, detail, trace_format)
+            
+            start = time.perf_counter() if _metrics().enabled else None
+            response = jsonify({
+                'success': True,
+                'result': result[result_key],
+                field: text,
+                'details': result['details']
+            })
+            if start is not None:
+                _metrics().observe('serialize', request.endpoint, time.perf_counter() - start,
+                                   len(text), response.calculate_content_length() or 0)
+        if cache_key:
+            cache.put(cache_key, response.get_data())
+        return response
+    except (RequestEntityTooLarge, Overloaded):
+        raise
     except Exception as e:
+        _metrics().error('endpoint', request.endpoint)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/decrypt', methods=['POST'])
+def _stream_trace(cipher, method, text, detail, trace_format, cost):
+    """NDJSON response emitting trace records while the layers run.
+
+    The body is a sequence of CipherMesh.iter_*_details records; a failure
+    after the headers are sent is reported as a final 'error' record. The
+    admission slot is held until the response is closed.
+    """
+    records = getattr(cipher, STREAM_METHODS[method])(text, detail=detail, trace_format=trace_format)
+    admission = _service().admission
+    ticket = _acquire(cost)
+    dumps = current_app.json.dumps
+    endpoint = request.endpoint
+    metrics = _metrics()
+
+    def generate():
+        try:
+            for record in records:
+                yield dumps(record) + '\n'
+        except Exception as e:
+            metrics.error('endpoint', endpoint)
+            yield dumps({'type': 'error', 'error': str(e)}) + '\n'
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype=NDJSON)
+    response.call_on_close(lambda: admission.release(ticket))
+    return response
+
+@bp.route('/api/encrypt', methods=['POST'])
+def encrypt():
+    """Encryption API endpoint."""
+    # Get encryption process at the requested detail level
+    return _run_single('plaintext', 'encrypt_with_details', 'ciphertext')
+
+@bp.route('/api/decrypt', methods=['POST'])
 def decrypt():
     """Decryption API endpoint."""
+    # Get decryption process (tagged approach makes this unambiguous)
+    return _run_single('ciphertext', 'decrypt_with_details', 'plaintext')
+
+@bp.route('/api/encrypt/compact', methods=['POST'])
+def encrypt_compact():
+    """Raw UTF-8 plaintext body in, compact binary ciphertext out."""
     try:
-        data = request.get_json()
-        ciphertext = data.get('ciphertext', '')
-        
-        if not ciphertext:
-            return jsonify({'error': 'Ciphertext is required'}), 400
-        
-        # Get detailed decryption process (tagged approach makes this unambiguous)
-        result = cipher_mesh.decrypt_with_details(ciphertext)
-        
+        plaintext = request.get_data().decode('utf-8')
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Body must be UTF-8 text'}), 400
+    if not plaintext:
+        return jsonify({'error': 'Plaintext is required'}), 400
+    with _admitted(len(plaintext)):
+        ciphertext = _service().cipher_mesh.encrypt_compact(plaintext)
+    return current_app.response_class(ciphertext, mimetype='application/octet-stream')
+
+@bp.route('/api/decrypt/compact', methods=['POST'])
+def decrypt_compact():
+    """Compact (or text) ciphertext body in, UTF-8 plaintext out."""
+    data = request.get_data()
+    if not data:
+        return jsonify({'error': 'Ciphertext is required'}), 400
+    try:
+        with _admitted(len(data)):
+            plaintext = _service().cipher_mesh.decrypt_any(data)
+    except ValueError as e:
+        # UnicodeDecodeError included: a text ciphertext must be ASCII
+        return jsonify({'error': f'Invalid ciphertext: {e}'}), 400
+    return current_app.response_class(plaintext, mimetype='text/plain')
+
+@bp.route('/api/encrypt/edit', methods=['POST'])
+def encrypt_edit():
+    """Incremental encryption: the ciphertext patch for one edit of a document.
+
+    Body: {"plaintext": previous text, "edit": {"start", "end", "text"},
+    optional "ciphertext" (previous, checked against the edited window) and "key"}.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Body must be a JSON object'}), 400
+        plaintext = data.get('plaintext')
+        edit = data.get('edit')
+        if not isinstance(plaintext, str) or not isinstance(edit, dict):
+            return jsonify({'error': 'plaintext and edit are required'}), 400
+        start, end, replacement = edit.get('start'), edit.get('end', edit.get('start')), edit.get('text', '')
+        # bool is an int subclass, so check the exact type
+        if type(start) is not int or type(end) is not int or not isinstance(replacement, str):
+            return jsonify({'error': 'edit needs integer start/end and a text string'}), 400
+        ciphertext = data.get('ciphertext')
+        if ciphertext is not None and not isinstance(ciphertext, str):
+            return jsonify({'error': 'ciphertext must be a string'}), 400
+
+        service = _service()
+        try:
+            cipher = service.cipher_for(data)
+            # an edit that shifts block alignment re-encrypts to the end of the document
+            with _admitted(service.cost(len(plaintext) + len(replacement), DETAIL_NONE)):
+                patch = cipher.encrypt_edit(plaintext, start, end, replacement, ciphertext)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         return jsonify({
             'success': True,
-            'result': result['plaintext'],
-            'ciphertext': ciphertext,
-            'details': result['details']
+            'patch': patch.to_dict(),
+            'length': 2 * (len(plaintext) - (end - start) + len(replacement))
         })
+    except (RequestEntityTooLarge, Overloaded):
+        raise
     except Exception as e:
+        _metrics().error('endpoint', request.endpoint)
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Result cache and compiled key cache statistics."""
+    service = _service()
+    return jsonify({
+        'results': service.result_cache.stats(),
+        'keys': service.key_cache.stats()
+    })
+
+@bp.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    """Admission control lanes: running and queued requests, waits and rejections."""
+    return jsonify(_service().admission.stats())
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the process's metrics."""
+    body = _metrics().prometheus() + _service().admission.prometheus()
+    return current_app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+def _read_batch_items():
+    """Parse a batch body: a JSON array, or NDJSON with one payload per line.
+
+    Returns (items, error_response). NDJSON lines that fail to parse are
+    kept as ValueError items so they are reported per item.
+    """
+    max_bytes = current_app.config['MAX_BATCH_BYTES']
+    if request.content_length is not None and request.content_length > max_bytes:
+        return None, (jsonify({'error': f'Request body exceeds {max_bytes} bytes'}), 413)
+    # read only what was announced; a bare read(max_bytes + 1) preallocates that much
+    body = request.stream.read(max_bytes + 1 if request.content_length is None else request.content_length)
+    if len(body) > max_bytes:
+        return None, (jsonify({'error': f'Request body exceeds {max_bytes} bytes'}), 413)
+
+    if request.mimetype == NDJSON:
+        try:
+            lines = body.decode('utf-8').splitlines()
+        except UnicodeDecodeError:
+            return None, (jsonify({'error': 'Body must be a JSON array or NDJSON'}), 400)
+        items = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(ValueError(f'Invalid JSON: {e}'))
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            return None, (jsonify({'error': 'Body must be a JSON array or NDJSON'}), 400)
+        if not isinstance(items, list):
+            return None, (jsonify({'error': 'Body must be a JSON array or NDJSON'}), 400)
+
+    max_items = current_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_items:
+        return None, (jsonify({'error': f'Batch exceeds {max_items} items'}), 413)
+    return items, None
+
+def _item_text(item, field):
+    """The text of a batch item, or '' for items that will be reported as invalid."""
+    text = item.get(field, '') if isinstance(item, dict) else item
+    return text if isinstance(text, str) else ''
+
+def _run_batch(field, operation, result_key):
+    """Run `operation` (a CipherMesh method name) over each batch item.
+
+    Object items may carry their own 'key'; errors are reported per item.
+    With detail=none, uncached items sharing a key run as one
+    CipherMesh.*_many call, which spreads large batches across the pool.
+    """
+    detail = request.args.get('detail', DETAIL_NONE)
+    if detail not in DETAIL_LEVELS:
+        return jsonify({'error': f"detail must be one of {', '.join(DETAIL_LEVELS)}"}), 400
+    trace_format = request.args.get('trace_format', TRACE_ROWS)
+    if trace_format not in TRACE_FORMATS:
+        return jsonify({'error': f"trace_format must be one of {', '.join(TRACE_FORMATS)}"}), 400
+
+    items, error = _read_batch_items()
+    if error:
+        return error
+
+    service = _service()
+    service.executor  # start the pool (if configured) before ciphers are compiled
+    cache = service.result_cache
+    dumps = current_app.json.dumps
+
+    def success(result, details=None):
+        entry = {'success': True, 'result': result}
+        if details is not None:
+            entry['details'] = details
+        return dumps(entry).encode('utf-8')
+
+    def failure(e):
+        _metrics().error('batch_item', request.endpoint)
+        return dumps({'success': False, 'error': str(e)}).encode('utf-8')
+
+    # the whole batch is admitted as one request, costed on all of its text
+    length = sum(len(_item_text(item, field)) for item in items)
+    with _admitted(service.cost(length, detail, trace_format)):
+        # each item is serialized on its own so cached items can be reused as-is
+        results = [None] * len(items)
+        # cipher -> [(index, text, cache_key)] left for one *_many call
+        pending = {}
+        for index, item in enumerate(items):
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                data = item if isinstance(item, dict) else {field: item}
+                text = data.get(field, '')
+                if not isinstance(text, str):
+                    raise ValueError(f'Each item must be a string or an object with "{field}"')
+                if not text:
+                    raise ValueError(f'{field.capitalize()} is required')
+                cipher = service.cipher_for(data)
+                cache_key = (make_key(f'{operation}/item/{trace_format}', cipher.key, detail, text)
+                             if cache.enabled else None)
+                encoded = cache.get(cache_key) if cache_key else None
+                if encoded is None:
+                    if detail == DETAIL_NONE:
+                        pending.setdefault(cipher, []).append((index, text, cache_key))
+                        continue
+                    result = service.run(cipher, operation, text, detail, trace_format)
+                    encoded = success(result[result_key], result['details'])
+                    if cache_key:
+                        cache.put(cache_key, encoded)
+                results[index] = encoded
+            except Exception as e:
+                results[index] = failure(e)
+
+        for cipher, group in pending.items():
+            try:
+                outputs = getattr(cipher, BATCH_METHODS[operation])([text for _, text, _ in group])
+            except Exception:
+                # one bad item fails the whole call; redo the group item by item
+                outputs = None
+            for position, (index, text, cache_key) in enumerate(group):
+                try:
+                    output = (outputs[position] if outputs is not None
+                              else service.run(cipher, operation, text, detail, trace_format)[result_key])
+                    results[index] = success(output)
+                    if cache_key:
+                        cache.put(cache_key, results[index])
+                except Exception as e:
+                    results[index] = failure(e)
+
+    body = b'{"count":%d,"results":[%s],"success":true}\n' % (len(results), b','.join(results))
+    return current_app.response_class(body, mimetype='application/json')
+
+@bp.route('/api/encrypt/batch', methods=['POST'])
+def encrypt_batch():
+    """Batch encryption endpoint; results are returned in request order."""
+    return _run_batch('plaintext', 'encrypt_with_details', 'ciphertext')
+
+@bp.route('/api/decrypt/batch', methods=['POST'])
+def decrypt_batch():
+    """Batch decryption endpoint; results are returned in request order."""
+    return _run_batch('ciphertext', 'decrypt_with_details', 'plaintext')
+
+def create_app(config=None):
+    """Application factory.
+
+    Settings come from DEFAULT_CONFIG, then CIPHERMESH_* environment
+    variables (values parsed as JSON, e.g. CIPHERMESH_CIPHER_WORKERS=4),
+    then `config`.
+    """
+    app = Flask(__name__)
+    app.json = CipherJSONProvider(app)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_prefixed_env('CIPHERMESH')
+    if config:
+        app.config.update(config)
+
+    service = CipherService(app.config)
+    app.extensions['ciphermesh'] = service
+
+    app.register_blueprint(bp)
+    return app
+
+# Module-level app for `python app.py` and simple imports
+app = create_app()
+
 if __name__ == '__main__':
     import socket
     
@@ -0,0 +1,162 @@
+"""
+CipherMesh Client Benchmark
+
+Calls per second for many small encrypt calls from concurrent threads,
+against a local server, comparing:
+
+- naive:      a new connection and one /api/encrypt request per call
+- pooled:     CipherClient over keep-alive connections, no coalescing
+- coalesced:  CipherClient coalescing concurrent calls into batch requests
+- async:      AsyncCipherClient, all calls as concurrent coroutines
+- local:      CipherClient(local=True), no server at all
+
+The server is the app under Gunicorn (keep-alive capable) when it is
+installed, else Werkzeug's threaded development server, which closes
+every connection, so pooling cannot help there.
+
+Usage:
+    python benchmarks/client_benchmark.py [--calls N] [--threads N]
+        [--size CHARS] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from client import AsyncCipherClient, CipherClient  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.05)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def start_server(port):
+    """Start the app on `port`; returns (description, stop function)."""
+    env = dict(os.environ, CIPHERMESH_BIND=f'127.0.0.1:{port}', CIPHERMESH_WEB_WORKERS='1',
+               CIPHERMESH_THREADS='16', CIPHERMESH_RESULT_CACHE_ENTRIES='0')
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        from werkzeug.serving import make_server
+        from app import create_app
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', port, create_app({'RESULT_CACHE_ENTRIES': 0}), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return 'werkzeug (no keep-alive)', server.shutdown
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+
+    def stop():
+        process.terminate()
+        process.wait()
+    return 'gunicorn (1 worker, 16 threads)', stop
+
+
+def naive_encrypt(port, text):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        conn.request('POST', '/api/encrypt', json.dumps({'plaintext': text, 'detail': 'none'}),
+                     {'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read())['result']
+    finally:
+        conn.close()
+
+
+def run_threads(call, texts, threads):
+    """Seconds to run call(text) for every text from `threads` threads."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(call, texts))
+    return time.perf_counter() - start, results
+
+
+def run(calls, threads, size, port):
+    filler = ('Hello, World! ' * (size // 14 + 1))[:size - 9]
+    # distinct texts, so no server-side cache could serve repeats
+    texts = [f'{i:08d} {filler}' for i in range(calls)]
+    results = {}
+
+    def record(name, seconds, outputs, reference):
+        if outputs != reference:
+            raise AssertionError(f'{name}: results differ from the reference')
+        results[name] = {'calls': calls, 'seconds': seconds, 'calls_per_sec': calls / seconds}
+        speedup = results[name]['calls_per_sec'] / results['naive']['calls_per_sec'] if 'naive' in results else 1.0
+        print(f"{name:<12} {results[name]['calls_per_sec']:>12,.0f} calls/s  {speedup:>7.1f}x")
+
+    seconds, reference = run_threads(lambda text: naive_encrypt(port, text), texts, threads)
+    record('naive', seconds, reference, reference)
+
+    url = f'http://127.0.0.1:{port}'
+    with CipherClient(url, window=0, pool_size=threads) as client:
+        client.encrypt('warm up')
+        seconds, outputs = run_threads(client.encrypt, texts, threads)
+        record('pooled', seconds, outputs, reference)
+
+    with CipherClient(url, pool_size=threads) as client:
+        client.encrypt('warm up')
+        seconds, outputs = run_threads(client.encrypt, texts, threads)
+        record('coalesced', seconds, outputs, reference)
+
+    async def run_async():
+        async with AsyncCipherClient(url, pool_size=threads) as client:
+            await client.encrypt('warm up')
+            start = time.perf_counter()
+            outputs = await client.encrypt_many(texts)
+            return time.perf_counter() - start, outputs
+    seconds, outputs = asyncio.run(run_async())
+    record('async', seconds, outputs, reference)
+
+    with CipherClient(local=True) as client:
+        seconds, outputs = run_threads(client.encrypt, texts, threads)
+        record('local', seconds, outputs, reference)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CipherMesh client against a local server')
+    parser.add_argument('--calls', type=int, default=5000, help='encrypt calls per case')
+    parser.add_argument('--threads', type=int, default=16, help='concurrent calling threads')
+    parser.add_argument('--size', type=int, default=64, help='characters per plaintext')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    description, stop = start_server(port)
+    print(f'server: {description}; {args.calls} calls of {args.size} chars from {args.threads} threads')
+    try:
+        results = run(args.calls, args.threads, max(args.size, 10), port)
+    finally:
+        stop()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'server': description, 'results': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
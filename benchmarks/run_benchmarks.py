@@ -0,0 +1,279 @@
+"""
+CipherMesh Benchmarks
+
+Measures throughput (chars/sec) of the individual layers, the full
+encrypt/decrypt pipeline at every detail level, the Flask endpoints and
+the headless cipher.py CLI, plus peak memory via tracemalloc. Results are
+written as JSON and can be compared against a stored baseline;
+regressions give a non-zero exit code.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--output results.json]
+        [--baseline benchmarks/baseline.json] [--save-baseline PATH]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cipher_logic import CipherMesh, GraphLayer, Pipeline, DETAIL_LEVELS, DETAIL_NONE, TRACE_COLUMNS  # noqa: E402
+
+SIZES = [10, 1_000, 100_000, 10_000_000, 100_000_000]
+QUICK_SIZES = [10, 1_000, 100_000]
+# Per-step traces hold several dicts per character; above this size they
+# would measure the allocator rather than the cipher
+MAX_DETAIL_SIZE = 1_000_000
+MAX_API_SIZE = 1_000_000
+MAX_CLI_SIZE = 10_000_000
+
+# Layer 3 with a key-derived block order instead of reversal
+KEYED_GRAPH = GraphLayer(8, GraphLayer.seeded_order(8, seed=0))
+# A deeper Pipeline: four affine rounds and four block sizes around Layer 1
+DEEP_PIPELINE = ([{'layer': 'set'}]
+                 + [{'layer': 'function', 'a': a, 'b': b} for a, b in [(3, 7), (7, 1), (11, 5), (2, 9)]]
+                 + [{'layer': 'graph', 'block_size': size} for size in (4, 3, 6, 4)]
+                 + [{'layer': 'function', 'a': 13, 'b': 2}])
+
+MIXES = {
+    'mixed': "The quick brown fox jumps over the lazy dog 0123456789 !?#",
+    'vowels': "aeiouAEIOU",
+    'digits': "0123456789",
+    'symbols': "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~ ",
+}
+
+
+def make_payload(mix, size, seed=0):
+    rng = random.Random(seed)
+    alphabet = MIXES[mix]
+    # build a random block once and repeat it so huge payloads are cheap to create
+    block = ''.join(rng.choice(alphabet) for _ in range(min(size, 65536)))
+    return (block * (size // len(block) + 1))[:size]
+
+
+def time_call(fn, min_time):
+    """Best wall time of fn() over enough repeats to fill min_time seconds."""
+    best = float('inf')
+    total = 0.0
+    runs = 0
+    while total < min_time or runs < 1:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return best, runs
+
+
+def peak_memory(fn):
+    """Peak traced allocation (bytes) while running fn() once."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def layer_cases(mesh, text, size):
+    """Per-layer cases: traced layer methods and their fast path equivalents."""
+    set_out = mesh.fast_path.set_encrypt(text)
+    function_out = mesh.fast_path.function_encrypt(set_out)
+    fast = mesh.fast_path
+    traced = size <= MAX_DETAIL_SIZE
+    cases = {
+        'layer1.encrypt.fast': lambda: fast.set_encrypt(text),
+        'layer2.encrypt.fast': lambda: fast.function_encrypt(set_out),
+        'layer3.transform.fast': lambda: fast.graph_transform(function_out),
+        'layer3.inverse.fast': lambda: fast.graph_inverse(function_out),
+        'layer3.keyed.fast': lambda: KEYED_GRAPH.permutation.apply(function_out),
+        'layer2.decrypt.fast': lambda: fast.function_decrypt(function_out),
+        'layer1.decrypt.fast': lambda: fast.set_decrypt(set_out),
+    }
+    if traced:
+        cases.update({
+            'layer1.encrypt.traced': lambda: mesh.set_layer.encrypt(text),
+            'layer2.encrypt.traced': lambda: mesh.function_layer.encrypt(set_out),
+            'layer3.transform.traced': lambda: mesh.graph_layer.encrypt(function_out),
+            'layer3.keyed.traced': lambda: KEYED_GRAPH.encrypt(function_out),
+            'layer2.decrypt.traced': lambda: mesh.function_layer.decrypt(function_out),
+            'layer1.decrypt.traced': lambda: mesh.set_layer.decrypt(set_out),
+        })
+    return cases
+
+
+def pipeline_cases(mesh, text, size):
+    ciphertext = mesh.encrypt(text)
+    cases = {}
+    for detail in DETAIL_LEVELS:
+        if detail != DETAIL_NONE and size > MAX_DETAIL_SIZE:
+            continue
+        cases[f'pipeline.encrypt.{detail}'] = lambda d=detail: mesh.encrypt_with_details(text, detail=d)
+        cases[f'pipeline.decrypt.{detail}'] = lambda d=detail: mesh.decrypt_with_details(ciphertext, detail=d)
+        if detail != DETAIL_NONE:
+            cases[f'pipeline.encrypt.{detail}.columns'] = lambda d=detail: mesh.encrypt_with_details(
+                text, detail=d, trace_format=TRACE_COLUMNS)
+            cases[f'pipeline.decrypt.{detail}.columns'] = lambda d=detail: mesh.decrypt_with_details(
+                ciphertext, detail=d, trace_format=TRACE_COLUMNS)
+    return cases
+
+
+def deep_pipeline_cases(text):
+    """DEEP_PIPELINE compiled by the optimizer vs. run one layer per pass."""
+    cases = {}
+    for name, optimize in (('optimized', True), ('layered', False)):
+        pipeline = Pipeline(DEEP_PIPELINE, optimize=optimize)
+        ciphertext = pipeline.encrypt(text)
+        cases[f'deep.encrypt.{name}'] = lambda p=pipeline: p.encrypt(text)
+        cases[f'deep.decrypt.{name}'] = lambda p=pipeline, c=ciphertext: p.decrypt(c)
+    return cases
+
+
+def api_cases(text, size):
+    if size > MAX_API_SIZE:
+        return {}
+    try:
+        from app import create_app
+    except ImportError:  # Flask not installed
+        return {}
+    # repeated payloads would otherwise be served from the result cache
+    client = create_app({'RESULT_CACHE_ENTRIES': 0}).test_client()
+    cached_client = create_app().test_client()
+    ciphertext = CipherMesh().encrypt(text)
+    cases = {
+        'api.encrypt.cached': lambda: cached_client.post(
+            '/api/encrypt', json={'plaintext': text, 'detail': 'summary'}),
+    }
+    for detail in DETAIL_LEVELS:
+        cases[f'api.encrypt.{detail}'] = lambda d=detail: client.post(
+            '/api/encrypt', json={'plaintext': text, 'detail': d})
+        cases[f'api.encrypt.{detail}.columns'] = lambda d=detail: client.post(
+            '/api/encrypt', json={'plaintext': text, 'detail': d, 'trace_format': TRACE_COLUMNS})
+        cases[f'api.decrypt.{detail}'] = lambda d=detail: client.post(
+            '/api/decrypt', json={'ciphertext': ciphertext, 'detail': d})
+    # the same payload split into 100 records, sent as one batch
+    records = [text[i::100] for i in range(100)] if size >= 100 else [text]
+    cases['api.encrypt_batch.none'] = lambda: client.post('/api/encrypt/batch', json=records)
+    return cases
+
+
+def cli_cases(text, size, workdir):
+    """`cipher.py encrypt|decrypt -i ... -o ...` as a subprocess, startup included."""
+    if size > MAX_CLI_SIZE:
+        return {}
+    script = os.path.join(ROOT, 'cipher.py')
+    src = os.path.join(workdir, 'input.txt')
+    encrypted = os.path.join(workdir, 'input.enc')
+    with open(src, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+
+    def command(operation, input_path, output_path):
+        return lambda: subprocess.run([sys.executable, script, operation, '-i', input_path, '-o', output_path],
+                                      check=True)
+
+    command('encrypt', src, encrypted)()
+    return {
+        'cli.encrypt': command('encrypt', src, os.path.join(workdir, 'output.enc')),
+        'cli.decrypt': command('decrypt', encrypted, os.path.join(workdir, 'output.txt')),
+    }
+
+
+def run(sizes, mixes, min_time, with_memory):
+    mesh = CipherMesh()
+    results = {}
+    for mix in mixes:
+        for size in sizes:
+            text = make_payload(mix, size)
+            cases = {}
+            cases.update(layer_cases(mesh, text, size))
+            cases.update(pipeline_cases(mesh, text, size))
+            cases.update(deep_pipeline_cases(text))
+            cases.update(api_cases(text, size))
+            workdir = tempfile.TemporaryDirectory()
+            cases.update(cli_cases(text, size, workdir.name))
+            for name, fn in cases.items():
+                seconds, runs = time_call(fn, min_time)
+                result = {
+                    'chars': size,
+                    'seconds': seconds,
+                    'runs': runs,
+                    'chars_per_sec': size / seconds if seconds else float('inf'),
+                }
+                # tracemalloc cannot see into the CLI subprocess
+                if with_memory and not name.startswith('cli.'):
+                    result['peak_memory'] = peak_memory(fn)
+                key = f'{name}/{mix}/{size}'
+                results[key] = result
+                print(f"{key:<48} {result['chars_per_sec']:>16,.0f} chars/s"
+                      + (f"  {result['peak_memory']:>14,} B peak" if 'peak_memory' in result else ''))
+            workdir.cleanup()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of results against baseline."""
+    regressions = []
+    for key, base in baseline.get('results', {}).items():
+        current = results.get(key)
+        if current is None:
+            continue
+        if current['chars_per_sec'] < base['chars_per_sec'] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {current['chars_per_sec']:,.0f} < "
+                               f"baseline {base['chars_per_sec']:,.0f} chars/s")
+        if 'peak_memory' in current and 'peak_memory' in base \
+                and current['peak_memory'] > base['peak_memory'] * (1 + tolerance):
+            regressions.append(f"{key}: peak memory {current['peak_memory']:,} > "
+                               f"baseline {base['peak_memory']:,} B")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CipherMesh benchmarks')
+    parser.add_argument('--quick', action='store_true', help='only payloads up to 100 KB')
+    parser.add_argument('--sizes', type=int, nargs='+', help='payload sizes in characters')
+    parser.add_argument('--mixes', nargs='+', choices=sorted(MIXES), default=sorted(MIXES))
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to spend per case')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc measurements')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--baseline', help='compare against this JSON results file')
+    parser.add_argument('--save-baseline', help='also write results here as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown/memory growth before failing')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results = run(sizes, args.mixes, args.min_time, not args.no_memory)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+CipherMesh Bulk Tool
+
+Encrypts or decrypts every file under a directory tree into a mirror
+tree. A thread pool overlaps file I/O while a process pool does the
+cipher work; each output is written to a temporary file and renamed into
+place, and finished files are appended to a manifest so an interrupted
+run resumes where it stopped.
+
+Usage:
+    python bulk.py encrypt|decrypt SRC_DIR DST_DIR [--mode bytes|text]
+        [--workers N] [--io-threads N] [--manifest PATH] [--restart]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cipher_logic import CipherKey, CipherMesh, PARALLEL_THRESHOLD, create_executor, keyed_call
+
+MANIFEST_NAME = '.ciphermesh-manifest.jsonl'
+# Files at least this large are read through mmap instead of one read() call
+MMAP_THRESHOLD = 1 << 20
+
+# CipherMesh method per (mode, operation). Bytes mode is
+# exact for any file; text mode matches /api/encrypt but folds characters
+# outside printable ASCII.
+METHODS = {
+    ('bytes', 'encrypt'): 'encrypt_bytes',
+    ('bytes', 'decrypt'): 'decrypt_bytes',
+    ('text', 'encrypt'): 'encrypt',
+    ('text', 'decrypt'): 'decrypt',
+}
+
+
+def iter_files(src_root, exclude=()):
+    """Yield paths of regular files under src_root, relative to it, in sorted order.
+
+    Manifests of earlier runs (e.g. when decrypting an encrypted tree) are skipped.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    for dirpath, dirnames, filenames in os.walk(src_root):
+        dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) not in exclude)
+        for name in sorted(filenames):
+            if name == MANIFEST_NAME:
+                continue
+            path = os.path.join(dirpath, name)
+            if os.path.isfile(path) and os.path.abspath(path) not in exclude:
+                yield os.path.relpath(path, src_root)
+
+
+class Manifest:
+    """Append-only JSON-lines record of finished files.
+
+    An entry counts as done only while the source file still has the size
+    and modification time it had when it was processed, the run uses the
+    same operation, mode and key, and the output file still exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._done[entry['path']] = (entry['size'], entry['mtime_ns'],
+                                                     entry['operation'], entry['mode'], entry['key'])
+                    except (ValueError, KeyError):
+                        continue  # torn last line of an interrupted run
+        except FileNotFoundError:
+            pass
+        self._file = None
+
+    def is_done(self, rel_path, stat, settings, dst_path):
+        """`settings` is {'operation', 'mode', 'key' (CipherKey.to_dict())} of this run."""
+        return (self._done.get(rel_path) == (stat.st_size, stat.st_mtime_ns, settings['operation'],
+                                             settings['mode'], settings['key'])
+                and os.path.isfile(dst_path))
+
+    def record(self, rel_path, stat, settings, bytes_out):
+        line = json.dumps(dict(settings, path=rel_path, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                               bytes_out=bytes_out)) + '\n'
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _read(path, size, text):
+    """File contents as str (text) or a bytes-like object (mmap for large files)."""
+    if text:
+        # newline='' keeps line endings exactly as stored
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        if size >= MMAP_THRESHOLD:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+
+def _atomic_write(path, data, text):
+    """Write data to path via a temporary file in the same directory and a rename."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8', newline='') if text else open(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class BulkProcessor:
+    """Encrypt/decrypt a directory tree with overlapped I/O and pooled compute.
+
+    Small files are sent whole to the process pool (keyed_call); files of
+    at least parallel_threshold are split across it by CipherMesh itself.
+    With workers=0 all work stays in the I/O threads.
+    """
+
+    def __init__(self, key=None, mode='bytes', workers=None, io_threads=8,
+                 parallel_threshold=PARALLEL_THRESHOLD):
+        if mode not in ('bytes', 'text'):
+            raise ValueError("mode must be 'bytes' or 'text'")
+        self.key = CipherKey() if key is None else key
+        self.mode = mode
+        self.io_threads = io_threads
+        self.executor = create_executor(workers) if workers != 0 else None
+        try:
+            self.cipher_mesh = CipherMesh(self.key, executor=self.executor,
+                                          parallel_threshold=parallel_threshold)
+            if mode == 'bytes':
+                # compile the mod 256 tables now, so a key unusable in bytes mode fails here
+                self.cipher_mesh.byte_cipher
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _compute(self, method, data):
+        if self.executor is None or len(data) >= self.cipher_mesh.parallel_threshold:
+            return getattr(self.cipher_mesh, method)(data)
+        if isinstance(data, mmap.mmap):
+            data = data[:]
+        return self.executor.submit(keyed_call, self.key, method, data).result()
+
+    def _process_file(self, operation, src_path, dst_path, size):
+        text = self.mode == 'text'
+        data = _read(src_path, size, text)
+        try:
+            result = self._compute(METHODS[self.mode, operation], data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        _atomic_write(dst_path, result, text)
+        return len(result.encode('utf-8')) if text else len(result)
+
+    def run(self, operation, src_root, dst_root, manifest_path=None, restart=False):
+        """Process every file under src_root into the same relative path under dst_root.
+
+        Returns a report dict: files, skipped, failed (list of (path, error)),
+        bytes_in, bytes_out, seconds and bytes_per_sec.
+        """
+        if operation not in ('encrypt', 'decrypt'):
+            raise ValueError("operation must be 'encrypt' or 'decrypt'")
+        manifest_path = manifest_path or os.path.join(dst_root, MANIFEST_NAME)
+        if restart and os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        manifest = Manifest(manifest_path)
+        settings = {'operation': operation, 'mode': self.mode, 'key': self.key.to_dict()}
+        report = {'files': 0, 'skipped': 0, 'failed': [], 'bytes_in': 0, 'bytes_out': 0}
+        lock = threading.Lock()
+
+        def handle(rel_path):
+            src_path, dst_path = os.path.join(src_root, rel_path), os.path.join(dst_root, rel_path)
+            try:
+                stat = os.stat(src_path)
+                if manifest.is_done(rel_path, stat, settings, dst_path):
+                    with lock:
+                        report['skipped'] += 1
+                    return
+                bytes_out = self._process_file(operation, src_path, dst_path, stat.st_size)
+                manifest.record(rel_path, stat, settings, bytes_out)
+            except Exception as e:
+                with lock:
+                    report['failed'].append((rel_path, str(e)))
+                return
+            with lock:
+                report['files'] += 1
+                report['bytes_in'] += stat.st_size
+                report['bytes_out'] += bytes_out
+
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.io_threads) as threads:
+                # the destination may live inside the source tree; never read it back
+                for _ in threads.map(handle, iter_files(src_root, exclude=(dst_root, manifest_path))):
+                    pass
+        finally:
+            manifest.close()
+        report['seconds'] = time.perf_counter() - start
+        report['bytes_per_sec'] = report['bytes_in'] / report['seconds'] if report['seconds'] else 0.0
+        return report
+
+
+def format_report(report):
+    lines = [
+        f"files processed: {report['files']}  skipped (manifest): {report['skipped']}  "
+        f"failed: {len(report['failed'])}",
+        f"bytes in: {report['bytes_in']:,}  bytes out: {report['bytes_out']:,}  "
+        f"time: {report['seconds']:.2f} s  throughput: {report['bytes_per_sec'] / 1e6:,.1f} MB/s",
+    ]
+    lines.extend(f"  failed: {path}: {error}" for path, error in report['failed'])
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Encrypt or decrypt a directory tree with CipherMesh')
+    parser.add_argument('operation', choices=['encrypt', 'decrypt'])
+    parser.add_argument('src', help='source directory')
+    parser.add_argument('dst', help='destination directory (same relative layout)')
+    parser.add_argument('--mode', choices=['bytes', 'text'], default='bytes',
+                        help='bytes: exact for any file (default); text: same ciphertext as /api/encrypt')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='cipher worker processes (default: CPU count; 0 = none)')
+    parser.add_argument('--io-threads', type=int, default=8, help='concurrent file reads/writes')
+    parser.add_argument('--manifest', help=f'resume manifest (default: DST/{MANIFEST_NAME})')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing manifest')
+    parser.add_argument('--key', help='CipherKey as JSON, e.g. \'{"a": 7, "block_size": 6}\'')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.src):
+        parser.error(f'{args.src} is not a directory')
+    try:
+        key = CipherKey.from_dict(json.loads(args.key)) if args.key else None
+        processor = BulkProcessor(key, args.mode, args.workers, args.io_threads)
+    except ValueError as e:
+        parser.error(f'invalid --key: {e}')
+
+    with processor:
+        report = processor.run(args.operation, args.src, args.dst, args.manifest, args.restart)
+    print(format_report(report))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,22 @@
+import argparse
+import contextlib
+import io
 import sys
 import os
 import time
 import random
 import shutil
 
+from cipher_logic import CipherMesh, LegacyCipher, TraceObserver
+
+# Characters read per chunk in headless mode
+CHUNK_SIZE = 1 << 16
+
+# Exit codes for headless mode (argparse exits with 2 on usage errors)
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_INTERRUPTED = 130
+
 # ---------------------- UI and Color Definitions ---------------------- #
 class UI:
     """Handles the UI, colors, and styling for the terminal."""
@@ -121,204 +134,197 @@ class UI:
             if choice in ['y', 'yes']: return True
             elif choice in ['n', 'no']: return False
 
-# ---------------------- Layer 1: Set Layer ---------------------- #
-class SetLayer:
-    def __init__(self):
-        self.vowels = "AEIOUaeiou"
-        self.consonants = "BCDFGHJKLMNPQRSTVWXYZcdfghjklmnpqrstvwxyz"
-        self.digits = "0123456789"
-        self.shifts = {'vowels': 5, 'consonants': 3, 'digits': 2, 'symbols': 1}
-        self.ui = UI()
-
-    def _shift_char(self, char, shift): return chr((ord(char) + shift) % 128)
-    def _unshift_char(self, char, shift): return chr((ord(char) - shift) % 128)
-
-    def encrypt(self, text):
-        encrypted_chars = []
-        self.ui.print_header("LAYER 1: SET CLASSIFICATION SHIFT")
-        for char in text:
-            if char in self.vowels: shift, rule = self.shifts['vowels'], "Vowel"
-            elif char in self.consonants: shift, rule = self.shifts['consonants'], "Consonant"
-            elif char in self.digits: shift, rule = self.shifts['digits'], "Digit"
-            else: shift, rule = self.shifts['symbols'], "Symbol"
-            encrypted_char = self._shift_char(char, shift)
-            print(f"  {self.ui.WHITE}├── Input: '{char}' ({rule}) | Applying Shift: {shift} | Output: '{encrypted_char}'")
-            encrypted_chars.append(encrypted_char)
-        self.ui.print_footer()
-        return "".join(encrypted_chars)
-
-    def decrypt(self, text):
-        decrypted_chars = []
-        self.ui.print_header("REVERSING LAYER 1: SET CLASSIFICATION SHIFT")
-        for char in text:
-            decrypted_char = ''
-            for rule, shift in self.shifts.items():
-                unshifted_char = self._unshift_char(char, shift)
-                is_match = False
-                if rule == 'vowels' and unshifted_char in self.vowels: is_match = True
-                elif rule == 'consonants' and unshifted_char in self.consonants: is_match = True
-                elif rule == 'digits' and unshifted_char in self.digits: is_match = True
-                if is_match:
-                    decrypted_char = unshifted_char
-                    print(f"  {self.ui.WHITE}├── Input: '{char}' | Matched Rule: {rule} | Reversing Shift: {shift} | Output: '{decrypted_char}'")
-                    break
-            if not decrypted_char:
-                decrypted_char = self._unshift_char(char, self.shifts['symbols'])
-                print(f"  {self.ui.WHITE}├── Input: '{char}' | Matched Rule: Symbol | Reversing Shift: {self.shifts['symbols']} | Output: '{decrypted_char}'")
-            decrypted_chars.append(decrypted_char)
-        self.ui.print_footer()
-        return "".join(decrypted_chars)
-
-# ---------------------- Layer 2: Function Layer ---------------------- #
-class FunctionLayer:
-    def __init__(self, a=3, b=7, m=128):
-        if self._gcd(a, m) != 1: raise ValueError("'a' must be coprime to 'm'.")
-        self.a, self.b, self.m = a, b, m
-        self.a_inv = self._mod_inverse(a, m)
-        self.ui = UI()
-
-    def _gcd(self, a, b):
-        while b: a, b = b, a % b
-        return a
-
-    def _mod_inverse(self, a, m):
-        for x in range(1, m):
-            if (a * x) % m == 1: return x
-        return None
-
-    def encrypt(self, text):
-        encrypted_chars = []
-        self.ui.print_header(f"LAYER 2: MATHEMATICAL SUBSTITUTION (f(x)=({self.a}x+{self.b})mod{self.m})")
-        for char in text:
-            x = ord(char)
-            encrypted_val = (self.a * x + self.b) % self.m
-            encrypted_char = chr(encrypted_val)
-            print(f"  {self.ui.WHITE}├── Input: '{char}' (ASCII:{x}) | Applying f({x}) | Output: '{encrypted_char}' (ASCII:{encrypted_val})")
-            encrypted_chars.append(encrypted_char)
-        self.ui.print_footer()
-        return "".join(encrypted_chars)
-
-    def decrypt(self, text):
-        decrypted_chars = []
-        self.ui.print_header(f"REVERSING LAYER 2: INVERSE FUNCTION (f⁻¹(y))")
-        for char in text:
-            y = ord(char)
-            decrypted_val = (self.a_inv * (y - self.b)) % self.m
-            decrypted_char = chr(decrypted_val)
-            print(f"  {self.ui.WHITE}├── Input: '{char}' (ASCII:{y}) | Applying f⁻¹({y}) | Output: '{decrypted_char}' (ASCII:{decrypted_val})")
-            decrypted_chars.append(decrypted_char)
-        self.ui.print_footer()
-        return "".join(decrypted_chars)
-
-# ---------------------- Layer 3: Graph Layer ---------------------- #
-class GraphLayer:
-    def __init__(self, block_size=4):
-        self.block_size = block_size
-        self.ui = UI()
-
-    def _transform(self, text):
-        transformed_text = ""
-        for i in range(0, len(text), self.block_size):
-            block = text[i:i+self.block_size]
-            transformed_text += block[::-1]
-        return transformed_text
-
-    def encrypt(self, text):
-        self.ui.print_header("LAYER 3: GRAPH TRANSFORMATION (BLOCK REVERSAL)")
-        print(f"  {self.ui.WHITE}├── Input: {text}")
-        encrypted_text = self._transform(text)
-        print(f"  {self.ui.WHITE}└── Output: {encrypted_text}")
-        self.ui.print_footer()
-        return encrypted_text
-
-    def decrypt(self, text):
-        self.ui.print_header("REVERSING LAYER 3: GRAPH TRANSFORMATION")
-        print(f"  {self.ui.WHITE}├── Input: {text}")
-        decrypted_text = self._transform(text)
-        print(f"  {self.ui.WHITE}└── Output: {decrypted_text}")
-        self.ui.print_footer()
-        return decrypted_text
-
-# ---------------------- Main CipherMesh System ---------------------- #
-class CipherMesh:
-    def __init__(self):
-        self.set_layer = SetLayer()
-        self.function_layer = FunctionLayer()
-        self.graph_layer = GraphLayer()
-        self.ui = UI()
-
-    def encrypt(self, plaintext):
-        self.ui.clear_screen()
-        self.ui.print_box("ENCRYPTION PROTOCOL: ACTIVE", [f"{self.ui.WHITE}Plaintext Payload: {plaintext}", f"Length: {len(plaintext)} characters"])
-        self.ui.show_loader("Processing Layers")
-
-        set_encrypted = self.set_layer.encrypt(plaintext)
-        function_encrypted = self.function_layer.encrypt(set_encrypted)
-        graph_encrypted = self.graph_layer.encrypt(function_encrypted)
-
-        self.ui.print_box("ENCRYPTION SUMMARY", [
-            f"{self.ui.RED}{self.ui.BOLD}SUCCESS: Plaintext transformed.",
-            f"{self.ui.WHITE}Final Ciphertext: {self.ui.BRIGHTRED}{graph_encrypted}{self.ui.WHITE}",
-            f"Resulting Length: {len(graph_encrypted)} characters"
-        ])
-        return graph_encrypted
-
-    def decrypt(self, ciphertext):
-        self.ui.clear_screen()
-        self.ui.print_box("DECRYPTION PROTOCOL: ACTIVE", [f"{self.ui.WHITE}Ciphertext Payload: {ciphertext}", f"Length: {len(ciphertext)} characters"])
-        self.ui.show_loader("Reversing Layers")
-
-        graph_decrypted = self.graph_layer.decrypt(ciphertext)
-        function_decrypted = self.function_layer.decrypt(graph_decrypted)
-        set_decrypted = self.set_layer.decrypt(function_decrypted)
-
-        self.ui.print_box("DECRYPTION SUMMARY", [
-            f"{self.ui.RED}{self.ui.BOLD}SUCCESS: Ciphertext reverted.",
-            f"{self.ui.WHITE}Final Plaintext: {self.ui.BRIGHTRED}{set_decrypted}{self.ui.WHITE}",
-            f"Original Length: {len(set_decrypted)} characters"
-        ])
-        return set_decrypted
-
-# ---------------------- Main execution ---------------------- #
-if __name__ == "__main__":
+# ---------------------- Terminal trace output ---------------------- #
+class TerminalTrace(TraceObserver):
+    """Prints the layer-by-layer trace of cipher_logic.CipherMesh.trace."""
+
+    def __init__(self, ui):
+        self.ui = ui
+        self._open = False
+
+    def _close_layer(self):
+        if self._open:
+            self.ui.print_footer()
+            self._open = False
+
+    def layer(self, record):
+        self._close_layer()
+        title = record['name'].upper()
+        if 'formula' in record:
+            title += f" ({record['formula']})"
+        self.ui.print_header(title)
+        self._open = True
+        if 'total_blocks' in record:
+            print(f"  {self.ui.WHITE}├── Input: {record['input']}")
+            print(f"  {self.ui.WHITE}└── Output: {record['output']}")
+
+    def steps(self, record):
+        white = self.ui.WHITE
+        lines = []
+        for step in record['steps']:
+            if 'formula' in step:
+                lines.append(f"  {white}├── Input: '{step['input']}' (ASCII:{step['input_ascii']}) | "
+                             f"Applying {step['formula']} | Output: '{step['output']}' (ASCII:{step['output_ascii']})")
+            else:
+                lines.append(f"  {white}├── Input: '{step['input']}' ({step['rule']}) | "
+                             f"Shift: {step['shift']} | Output: '{step['output']}'")
+        print('\n'.join(lines))
+
+    def result(self, record):
+        self._close_layer()
+
+# ---------------------- Protocols ---------------------- #
+def encrypt_interactive(ui, cipher_mesh, plaintext):
+    ui.clear_screen()
+    ui.print_box("ENCRYPTION PROTOCOL: ACTIVE", [f"{ui.WHITE}Plaintext Payload: {plaintext}", f"Length: {len(plaintext)} characters"])
+    ui.show_loader("Processing Layers")
+
+    ciphertext = cipher_mesh.trace('encrypt', plaintext, TerminalTrace(ui))
+
+    ui.print_box("ENCRYPTION SUMMARY", [
+        f"{ui.RED}{ui.BOLD}SUCCESS: Plaintext transformed.",
+        f"{ui.WHITE}Final Ciphertext: {ui.BRIGHTRED}{ciphertext}{ui.WHITE}",
+        f"Resulting Length: {len(ciphertext)} characters"
+    ])
+    return ciphertext
+
+def decrypt_interactive(ui, cipher_mesh, ciphertext):
+    ui.clear_screen()
+    ui.print_box("DECRYPTION PROTOCOL: ACTIVE", [f"{ui.WHITE}Ciphertext Payload: {ciphertext}", f"Length: {len(ciphertext)} characters"])
+    ui.show_loader("Reversing Layers")
+
+    plaintext = cipher_mesh.trace('decrypt', ciphertext, TerminalTrace(ui))
+
+    ui.print_box("DECRYPTION SUMMARY", [
+        f"{ui.RED}{ui.BOLD}SUCCESS: Ciphertext reverted.",
+        f"{ui.WHITE}Final Plaintext: {ui.BRIGHTRED}{plaintext}{ui.WHITE}",
+        f"Original Length: {len(plaintext)} characters"
+    ])
+    return plaintext
+
+# ---------------------- Interactive menu ---------------------- #
+def run_interactive():
     ui = UI()
     cipher_mesh = CipherMesh()
 
-    def run_system():
-        ui.print_banner()
-        while True:
-            ui.print_menu()
-            choice = ui.get_input("Select an option (1-3)")
-
-            if choice == '1':
-                ui.clear_screen()
-                ui.print_box("ENCRYPTION MODULE", ["Awaiting user input for plaintext payload."])
-                plaintext = ui.get_input("Enter plaintext")
-                if ui.get_confirmation(f"Confirm encryption for '{plaintext}'?"):
-                    cipher_mesh.encrypt(plaintext)
-                else:
-                    print(f"\n{ui.RED}[!] Encryption aborted by user.{ui.ENDC}")
-                input(f"\n{ui.WHITE}Press Enter to return to the main menu...{ui.ENDC}")
-                ui.print_banner()
-
-            elif choice == '2':
-                ui.clear_screen()
-                ui.print_box("DECRYPTION MODULE", ["Awaiting user input for ciphertext payload."])
-                ciphertext = ui.get_input("Enter ciphertext")
-                if ui.get_confirmation(f"Confirm decryption for '{ciphertext}'?"):
-                    cipher_mesh.decrypt(ciphertext)
-                else:
-                    print(f"\n{ui.RED}[!] Decryption aborted by user.{ui.ENDC}")
-                input(f"\n{ui.WHITE}Press Enter to return to the main menu...{ui.ENDC}")
-                ui.print_banner()
-
-            elif choice == '3':
-                print(f"\n{ui.RED}{ui.BOLD}CipherMesh shutting down. Stay secure.{ui.ENDC}\n")
-                break
-
+    ui.print_banner()
+    while True:
+        ui.print_menu()
+        choice = ui.get_input("Select an option (1-3)")
+
+        if choice == '1':
+            ui.clear_screen()
+            ui.print_box("ENCRYPTION MODULE", ["Awaiting user input for plaintext payload."])
+            plaintext = ui.get_input("Enter plaintext")
+            if ui.get_confirmation(f"Confirm encryption for '{plaintext}'?"):
+                encrypt_interactive(ui, cipher_mesh, plaintext)
+            else:
+                print(f"\n{ui.RED}[!] Encryption aborted by user.{ui.ENDC}")
+            input(f"\n{ui.WHITE}Press Enter to return to the main menu...{ui.ENDC}")
+            ui.print_banner()
+
+        elif choice == '2':
+            ui.clear_screen()
+            ui.print_box("DECRYPTION MODULE", ["Awaiting user input for ciphertext payload."])
+            ciphertext = ui.get_input("Enter ciphertext")
+            if ui.get_confirmation(f"Confirm decryption for '{ciphertext}'?"):
+                decrypt_interactive(ui, cipher_mesh, ciphertext)
             else:
-                print(f"\n{ui.RED}[!] Invalid option. Please select 1, 2, or 3.{ui.ENDC}")
-                time.sleep(2)
-                ui.print_banner()
-    run_system()
+                print(f"\n{ui.RED}[!] Decryption aborted by user.{ui.ENDC}")
+            input(f"\n{ui.WHITE}Press Enter to return to the main menu...{ui.ENDC}")
+            ui.print_banner()
+
+        elif choice == '3':
+            print(f"\n{ui.RED}{ui.BOLD}CipherMesh shutting down. Stay secure.{ui.ENDC}\n")
+            break
+
+        else:
+            print(f"\n{ui.RED}[!] Invalid option. Please select 1, 2, or 3.{ui.ENDC}")
+            time.sleep(2)
+            ui.print_banner()
+
+# ---------------------- Headless mode ---------------------- #
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {number}')
+    return number
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cipher.py',
+        description='CipherMesh. Without arguments the interactive menu starts; '
+                    'with a command, text is read from a file or stdin and written '
+                    'to a file or stdout with no other output.')
+    commands = parser.add_subparsers(dest='command', metavar='{encrypt,decrypt}')
+    for name in ('encrypt', 'decrypt'):
+        command = commands.add_parser(name, help=f'{name} text headlessly')
+        command.add_argument('-i', '--input', help='input file (default: stdin)')
+        command.add_argument('-o', '--output', help='output file (default: stdout)')
+        command.add_argument('--chunk-size', type=_positive_int, default=CHUNK_SIZE,
+                             help=f'characters processed per chunk (default: {CHUNK_SIZE})')
+    commands.choices['decrypt'].add_argument(
+        '--legacy', action='store_true',
+        help='decrypt ciphertext produced by the original m=128 terminal cipher')
+    return parser
+
+@contextlib.contextmanager
+def _open_text(path, mode, std):
+    """UTF-8 text stream for path, or for the std stream when path is None/'-'.
+
+    newline='' keeps \\r and \\r\\n intact in both directions.
+    """
+    if path not in (None, '-'):
+        with open(path, mode, encoding='utf-8', newline='') as f:
+            yield f
+        return
+    stream = io.TextIOWrapper(std.buffer, encoding='utf-8', newline='')
+    try:
+        yield stream
+    finally:
+        stream.flush()
+        # leave the underlying std stream open
+        stream.detach()
+
+def _read_chunks(src, chunk_size):
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def run_headless(args):
+    """Run one encrypt/decrypt command and return the process exit code."""
+    try:
+        with _open_text(args.input, 'r', sys.stdin) as src, _open_text(args.output, 'w', sys.stdout) as dst:
+            chunks = _read_chunks(src, args.chunk_size)
+            if getattr(args, 'legacy', False):
+                output = LegacyCipher().decrypt_stream(chunks, args.chunk_size)
+            else:
+                output = getattr(CipherMesh(), f'{args.command}_stream')(chunks, args.chunk_size)
+            for chunk in output:
+                dst.write(chunk)
+    except BrokenPipeError:
+        # the reader went away (e.g. `| head`); keep Python from complaining at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_ERROR
+    except (OSError, UnicodeError) as e:
+        print(f"cipher.py: error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    return EXIT_OK
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        run_interactive()
+        return EXIT_OK
+    return run_headless(args)
 
+# ---------------------- Main execution ---------------------- #
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,27 @@ CipherMesh Core Logic - Web Version
 Updated to match the correct implementation with tagged categories
 """
 
+import functools
+import mmap
+import operator
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+
+from metrics import REGISTRY as METRICS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure Python fast path is used instead
+    np = None
+
 # ---------------------- Layer 1: Set Layer (Fixed with tags) ---------------------- #
 class SetLayer:
     """
@@ -16,12 +37,14 @@ class SetLayer:
     PRINT_MAX = 126
     PRINT_RANGE = PRINT_MAX - PRINT_MIN + 1
 
-    def __init__(self):
+    DEFAULT_SHIFTS = {'V': 5, 'C': 3, 'D': 2, 'S': 1}
+
+    def __init__(self, shifts=None):
         self.vowels = set("AEIOUaeiou")
         self.digits = set("0123456789")
         # consonants are any alphabetic characters not in vowels
         # shifts chosen so categories remain distinct when reversed using the tag
-        self.shifts = {'V': 5, 'C': 3, 'D': 2, 'S': 1}
+        self.shifts = dict(self.DEFAULT_SHIFTS if shifts is None else shifts)
 
     def _to_printable_index(self, ch):
         return ord(ch) - self.PRINT_MIN
@@ -101,22 +124,59 @@ class SetLayer:
             i += 2
         return ''.join(decrypted), steps
 
+    def encrypt_columns(self, text, output):
+        """Columnar trace of encrypt(text), given its output."""
+        codes = _codes(text)
+        if codes and (min(codes) < self.PRINT_MIN or max(codes) > self.PRINT_MAX):
+            # folded into the printable range like encrypt() does
+            codes = array('B', (ord(self._from_printable_index(c)) if not self.PRINT_MIN <= c <= self.PRINT_MAX
+                                else c for c in codes))
+        return SetColumns('encrypt', output[0::2], codes, _codes(output[1::2]), self.shifts)
+
+    def decrypt_columns(self, text, output):
+        """Columnar trace of decrypt(text), given its output."""
+        pairs = len(text) // 2
+        return SetColumns('decrypt', text[0::2], _codes(text[1::2]), _codes(output[:pairs]), self.shifts,
+                          truncated=len(text) % 2 == 1)
+
 # ---------------------- Layer 2: Function Layer (Fixed to printable range) ---------------------- #
 class FunctionLayer:
     """
     Maps printable ASCII [32..126] -> indices [0..94] and applies affine transformation
     f(x) = (a*x + b) mod m where m = 95 (printable count). We always work within printable range.
+
+    Other alphabets are supported too: either a contiguous code point range
+    of size m starting at `offset` (e.g. offset=0, m=0x110000 for all of
+    Unicode, or m=256 for bytes), or an explicit `alphabet` string of
+    distinct symbols. The inverse of 'a' is found with the extended
+    Euclidean algorithm, so construction stays cheap for very large m;
+    forward/inverse tables are only precomputed when m <= TABLE_LIMIT.
     """
     PRINT_MIN = 32
     PRINT_MAX = 126
     M = PRINT_MAX - PRINT_MIN + 1  # 95
+    TABLE_LIMIT = 1 << 16
 
-    def __init__(self, a=3, b=7, m=None):
+    def __init__(self, a=3, b=7, m=None, alphabet=None, offset=PRINT_MIN):
+        if alphabet is not None:
+            if len(set(alphabet)) != len(alphabet):
+                raise ValueError("alphabet symbols must be distinct.")
+            if m is not None and m != len(alphabet):
+                raise ValueError("'m' must equal the alphabet size.")
+            m = len(alphabet)
         m = self.M if m is None else m
+        if m < 1:
+            raise ValueError("'m' must be positive.")
         if self._gcd(a, m) != 1:
             raise ValueError("'a' must be coprime to 'm'.")
         self.a, self.b, self.m = a, b, m
         self.a_inv = self._mod_inverse(a, m)
+        self.alphabet, self.offset = alphabet, offset
+        self._index = None if alphabet is None else {ch: i for i, ch in enumerate(alphabet)}
+        self._forward = self._inverse = None
+        if m <= self.TABLE_LIMIT:
+            self._forward = [(a * x + b) % m for x in range(m)]
+            self._inverse = [(self.a_inv * (y - b)) % m for y in range(m)]
 
     def _gcd(self, a, b):
         while b:
@@ -124,23 +184,35 @@ class FunctionLayer:
         return a
 
     def _mod_inverse(self, a, m):
-        for x in range(1, m):
-            if (a * x) % m == 1:
-                return x
-        return None
+        # extended Euclidean algorithm, O(log m)
+        old_r, r = a % m, m
+        old_s, s = 1, 0
+        while r:
+            q = old_r // r
+            old_r, r = r, old_r - q * r
+            old_s, s = s, old_s - q * s
+        return old_s % m if old_r == 1 else None
 
     def _to_index(self, ch):
-        return ord(ch) - self.PRINT_MIN
+        if self._index is not None:
+            try:
+                return self._index[ch]
+            except KeyError:
+                raise ValueError(f"character {ch!r} is not in the alphabet.") from None
+        return ord(ch) - self.offset
 
     def _from_index(self, idx):
-        return chr((idx % self.m) + self.PRINT_MIN)
+        if self.alphabet is not None:
+            return self.alphabet[idx % self.m]
+        return chr((idx % self.m) + self.offset)
 
     def encrypt(self, text):
         encrypted = []
         steps = []
+        forward = self._forward
         for ch in text:
             idx = self._to_index(ch)
-            y = (self.a * idx + self.b) % self.m
+            y = forward[idx % self.m] if forward else (self.a * idx + self.b) % self.m
             out = self._from_index(y)
             encrypted.append(out)
             steps.append({
@@ -155,12 +227,11 @@ class FunctionLayer:
     def decrypt(self, text):
         decrypted = []
         steps = []
+        inverse = self._inverse
         for ch in text:
             y = self._to_index(ch)
-            x = (self.a_inv * (y - self.b)) % self.m
-            # Handle negative modulo correctly
-            if x < 0:
-                x = (x + self.m) % self.m
+            # Python's % is non-negative for positive m, so no correction is needed
+            x = inverse[y % self.m] if inverse else (self.a_inv * (y - self.b)) % self.m
             out = self._from_index(x)
             decrypted.append(out)
             steps.append({
@@ -172,134 +243,1762 @@ class FunctionLayer:
             })
         return ''.join(decrypted), steps
 
-# ---------------------- Layer 3: Graph Layer (block reversal) ---------------------- #
+    def encrypt_columns(self, text, output):
+        """Columnar trace of encrypt(text), given its output."""
+        return FunctionColumns('encrypt', _codes(text), _codes(output), self)
+
+    def decrypt_columns(self, text, output):
+        """Columnar trace of decrypt(text), given its output."""
+        return FunctionColumns('decrypt', _codes(text), _codes(output), self)
+
+# ---------------------- Layer 3: Graph Layer (block permutation) ---------------------- #
 class GraphLayer:
-    def __init__(self, block_size=4):
+    """
+    Reorders text within fixed-size blocks.
+
+    `order` is a traversal of each block: output position j takes the
+    character at position order[j] of the input block. The default order
+    reverses every block. A ragged final block is permuted within itself
+    (see Permutation.blocks). The forward and inverse permutations are
+    built once here and applied as strided slice copies, not block by block.
+    """
+    def __init__(self, block_size=4, order=None):
+        order = tuple(range(block_size - 1, -1, -1) if order is None else order)
+        if (block_size < 1 or not all(isinstance(i, int) and not isinstance(i, bool) for i in order)
+                or sorted(order) != list(range(block_size))):
+            raise ValueError("'order' must be a permutation of 0..block_size-1")
         self.block_size = block_size
+        self.order = order
+        self.permutation = Permutation.blocks(order)
+        self.inverse_permutation = self.permutation.inverse()
+        # index arrays for full blocks, shared by every call
+        self.forward_index = self.permutation.gather(block_size)
+        self.inverse_index = self.inverse_permutation.gather(block_size)
+
+    @staticmethod
+    def seeded_order(block_size, seed):
+        """A key-derived order: the same pseudo-random permutation for the same seed."""
+        order = list(range(block_size))
+        random.Random(seed).shuffle(order)
+        return tuple(order)
 
-    def _transform(self, text):
-        transformed = []
-        for i in range(0, len(text), self.block_size):
-            block = text[i:i+self.block_size]
-            transformed.append(block[::-1])
-        return ''.join(transformed)
+    def _blocks(self, text, permutation):
+        output = permutation.apply(text)
+        # blocks are permuted within themselves, so each output block is the same slice
+        blocks = [{'original': text[i:i+self.block_size], 'transformed': output[i:i+self.block_size]}
+                  for i in range(0, len(text), self.block_size)]
+        return output, blocks
 
     def encrypt(self, text):
-        encrypted_text = self._transform(text)
-        # Show block transformation
-        blocks = []
-        for i in range(0, len(text), self.block_size):
-            block = text[i:i+self.block_size]
-            reversed_block = block[::-1]
-            blocks.append({
-                'original': block,
-                'transformed': reversed_block
-            })
-        return encrypted_text, blocks
+        return self._blocks(text, self.permutation)
 
     def decrypt(self, text):
-        # same operation because reversal is its own inverse
-        decrypted_text = self._transform(text)
-        blocks = []
-        for i in range(0, len(text), self.block_size):
-            block = text[i:i+self.block_size]
-            reversed_block = block[::-1]
-            blocks.append({
-                'original': block,
-                'transformed': reversed_block
-            })
-        return decrypted_text, blocks
+        return self._blocks(text, self.inverse_permutation)
+
+    def encrypt_columns(self, text, output):
+        """Columnar trace of encrypt(text); blocks are cut from `text` on access."""
+        return BlockColumns(text, self.block_size, self.permutation)
+
+    def decrypt_columns(self, text, output):
+        """Columnar trace of decrypt(text)."""
+        return BlockColumns(text, self.block_size, self.inverse_permutation)
+
+# ---------------------- Columnar traces ---------------------- #
+def _codes(text):
+    """Character codes of text as an array, one byte each when they fit."""
+    try:
+        return array('B', text.encode('latin-1'))
+    except UnicodeEncodeError:
+        return array('I', map(ord, text))
+
+
+def _chars(codes):
+    """Inverse of _codes: the string of an array of character codes."""
+    if codes.typecode == 'B':
+        return codes.tobytes().decode('latin-1')
+    return ''.join(map(chr, codes))
+
+
+class TraceColumns:
+    """
+    Trace of one layer stored as parallel columns instead of a dict per step.
+
+    Reads as a sequence of the same step/block dicts the layer's
+    encrypt/decrypt methods return; each one (formula included) is only
+    built when it is accessed. to_dict() is the compact JSON form, with
+    code columns written as strings (one character per step), which
+    static/js/main.js expands back into steps.
+    """
+    __slots__ = ()
+
+    def _row(self, index):
+        raise NotImplementedError
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('trace index out of range')
+        return self._row(index)
+
+    def __iter__(self):
+        return map(self._row, range(len(self)))
+
+    def __eq__(self, other):
+        if isinstance(other, (TraceColumns, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'<{type(self).__name__} of {len(self)}>'
+
+
+class SetColumns(TraceColumns):
+    """Layer 1 steps: tag letters plus input/output character codes.
+
+    For encryption `input` holds the (folded) plaintext codes and `output`
+    the shifted codes that follow each tag; for decryption `input` holds
+    the shifted codes and `output` the plaintext codes. A malformed
+    trailing tag (odd-length ciphertext) is the last rule with no codes.
+    """
+    __slots__ = ('mode', 'rule', 'input', 'output', 'shifts', 'truncated')
+
+    def __init__(self, mode, rule, input, output, shifts, truncated=False):
+        self.mode, self.rule, self.input, self.output = mode, rule, input, output
+        self.shifts, self.truncated = shifts, truncated
+
+    def __len__(self):
+        return len(self.rule)
+
+    def _row(self, index):
+        cat = self.rule[index]
+        shift = self.shifts.get(cat, self.shifts['S'])
+        if self.mode == 'encrypt':
+            return {'input': chr(self.input[index]), 'rule': cat, 'shift': shift,
+                    'output': cat + chr(self.output[index])}
+        if index == len(self.input):
+            return {'input': cat, 'rule': 'Symbol', 'shift': shift, 'output': cat}
+        return {'input': cat + chr(self.input[index]), 'rule': cat, 'shift': shift,
+                'output': chr(self.output[index])}
+
+    def to_dict(self):
+        data = {'format': 'columns', 'layer': 'set', 'mode': self.mode, 'rule': self.rule,
+                'input': _chars(self.input), 'output': _chars(self.output), 'shifts': self.shifts}
+        if self.truncated:
+            data['truncated'] = True
+        return data
+
+
+class FunctionColumns(TraceColumns):
+    """Layer 2 steps: input/output character codes plus the affine key."""
+    __slots__ = ('mode', 'input', 'output', 'a', 'b', 'a_inv', 'm', 'offset', 'alphabet')
+
+    def __init__(self, mode, input, output, function_layer):
+        self.mode, self.input, self.output = mode, input, output
+        self.a, self.b, self.a_inv, self.m = function_layer.a, function_layer.b, function_layer.a_inv, function_layer.m
+        self.offset, self.alphabet = function_layer.offset, function_layer.alphabet
+
+    def __len__(self):
+        return len(self.input)
+
+    def _index(self, code):
+        return self.alphabet.index(chr(code)) if self.alphabet is not None else code - self.offset
+
+    def _row(self, index):
+        code_in, code_out = self.input[index], self.output[index]
+        x, y = self._index(code_in), self._index(code_out)
+        if self.mode == 'encrypt':
+            formula = f"({self.a}×{x}+{self.b}) mod {self.m} = {y}"
+        else:
+            formula = f"f⁻¹({x}) = ({self.a_inv}×({x}-{self.b})) mod {self.m} = {y}"
+        return {'input': chr(code_in), 'input_ascii': code_in, 'output': chr(code_out),
+                'output_ascii': code_out, 'formula': formula}
+
+    def to_dict(self):
+        data = {'format': 'columns', 'layer': 'function', 'mode': self.mode,
+                'input': _chars(self.input), 'output': _chars(self.output),
+                'a': self.a, 'b': self.b, 'a_inv': self.a_inv, 'm': self.m, 'offset': self.offset}
+        if self.alphabet is not None:
+            data['alphabet'] = self.alphabet
+        return data
+
+
+class BlockColumns(TraceColumns):
+    """Layer 3 blocks: the layer input itself, cut into blocks on access.
+
+    Stores the block order (and the ragged final block's order) rather
+    than the permutation, so traces stay picklable.
+    """
+    __slots__ = ('text', 'block_size', 'order', 'tail')
+
+    def __init__(self, text, block_size, permutation):
+        self.text, self.block_size = text, block_size
+        self.order = tuple(permutation.gather(block_size))
+        self.tail = tuple(permutation.gather(len(text) % block_size))
+
+    def __len__(self):
+        return -(-len(self.text) // self.block_size)
+
+    def _row(self, index):
+        block = self.text[index * self.block_size:(index + 1) * self.block_size]
+        order = self.order if len(block) == self.block_size else self.tail
+        return {'original': block, 'transformed': ''.join([block[i] for i in order])}
+
+    def to_dict(self):
+        data = {'format': 'columns', 'layer': 'graph', 'block_size': self.block_size,
+                'order': list(self.order), 'text': self.text}
+        if self.tail:
+            data['tail'] = list(self.tail)
+        return data
+
+# ---------------------- Fast Path: fused translation tables ---------------------- #
+class _LookupTable(dict):
+    """
+    Translation table precomputed over the printable range. Keys outside it
+    (e.g. non-ASCII input) are computed on demand and not stored, so the
+    table stays bounded whatever text is pushed through it.
+    """
+    def __init__(self, compute, keys):
+        super().__init__((key, compute(key)) for key in keys)
+        self._compute = compute
+
+    def __missing__(self, key):
+        return self._compute(key)
+
+
+def _reverse_blocks_into(src, out, block_size):
+    """Write `src` reversed in blocks of `block_size` into `out` and return it.
+
+    Position j of every full block receives the element at position
+    block_size-1-j, so each of the block_size lanes is a single strided
+    slice assignment instead of one Python-level operation per block.
+    `src`/`out` may be str/list or any bytes-like object/writable buffer.
+    """
+    n = len(src)
+    full = n - n % block_size
+    if block_size > full // block_size:
+        # few, wide blocks: reversing each block directly is cheaper
+        for i in range(0, n, block_size):
+            out[i:min(i + block_size, n)] = src[i:i+block_size][::-1]
+        return out
+    for j in range(block_size):
+        out[j:full:block_size] = src[block_size-1-j:full:block_size]
+    out[full:n] = src[full:][::-1]
+    return out
+
+
+def _reverse_blocks(text, block_size):
+    """Reverse `text` in blocks of `block_size` (see _reverse_blocks_into)."""
+    try:
+        src = text.encode('ascii')
+    except UnicodeEncodeError:
+        return ''.join(_reverse_blocks_into(text, [''] * len(text), block_size))
+    return _reverse_blocks_into(src, bytearray(len(src)), block_size).decode('ascii')
+
+
+class Permutation:
+    """
+    Block-local reordering of a sequence as gather indices: out[j] = in[gather[j]].
+
+    Every full `period` of the input is permuted the same way, and a
+    trailing partial period of r items by gather(r), so one precomputed
+    period is applied to any length as `period` strided slice copies.
+    Works on str (via ASCII bytes where possible), lists, bytes-like
+    objects and writable buffers.
+    """
+    GATHER_CACHE_SIZE = 64
+    # Largest period whose trailing partial periods are all checked by is_identity
+    IDENTITY_CHECK_LIMIT = 256
+
+    def __init__(self, period, gather, label):
+        self.period = period
+        self.gather = functools.lru_cache(maxsize=self.GATHER_CACHE_SIZE)(gather)
+        self.label = label
+
+    @classmethod
+    def blocks(cls, order):
+        """Blocks of len(order) items, position j taking the item at order[j].
+
+        A ragged final block of r items keeps the positions below r in the
+        order they have in `order`, so it is permuted within itself.
+        """
+        order = tuple(order)
+        size = len(order)
+
+        def gather(n):
+            full = n - n % size
+            result = [start + i for start in range(0, full, size) for i in order]
+            result.extend(full + i for i in order if i < n - full)
+            return result
+
+        if order == tuple(range(size - 1, -1, -1)):
+            label = f'reverse blocks of {size}'
+        else:
+            label = f"blocks of {size} in order {','.join(map(str, order))}"
+        return cls(size, gather, label)
+
+    def scaled(self, factor):
+        """The same reordering applied to groups of `factor` items (e.g. Layer 1 tag pairs)."""
+        def gather(n):
+            if n % factor:
+                raise ValueError(f"length {n} is not a multiple of {factor}")
+            base = self.gather(n // factor)
+            return [base[j // factor] * factor + j % factor for j in range(n)]
+        return Permutation(self.period * factor, gather, f'{self.label} (in groups of {factor})')
+
+    def then(self, other):
+        """This reordering followed by `other`, as one permutation."""
+        def gather(n):
+            first = self.gather(n)
+            return [first[i] for i in other.gather(n)]
+        period = self.period * other.period // _gcd(self.period, other.period)
+        return Permutation(period, gather, f'{self.label}, then {other.label}')
+
+    def inverse(self):
+        def gather(n):
+            forward = self.gather(n)
+            result = [0] * n
+            for j, i in enumerate(forward):
+                result[i] = j
+            return result
+        return Permutation(self.period, gather, f'inverse of ({self.label})')
+
+    def is_identity(self):
+        if self.period > self.IDENTITY_CHECK_LIMIT:
+            return False
+        for r in range(1, self.period + 1):
+            try:
+                if self.gather(r) != list(range(r)):
+                    return False
+            except ValueError:
+                continue  # a length this permutation is never applied to
+        return True
+
+    def apply_into(self, src, out):
+        """Write `src` permuted into `out` (a list or writable buffer of the same length) and return it."""
+        n, period = len(src), self.period
+        full = n - n % period
+        pack = list if isinstance(out, list) else bytes
+        if full and period > 1:
+            order = self.gather(period)
+            if period > full // period:
+                # few, wide periods: one C-level gather per period is cheaper
+                get = operator.itemgetter(*order)
+                for start in range(0, full, period):
+                    out[start:start + period] = pack(get(src[start:start + period]))
+            else:
+                for j, i in enumerate(order):
+                    out[j:full:period] = src[i:full:period]
+        elif full:
+            out[:full] = src[:full]
+        if full < n - 1:
+            out[full:n] = pack(operator.itemgetter(*self.gather(n - full))(src[full:n]))
+        elif full < n:
+            out[full:n] = src[full:n]
+        return out
+
+    def apply(self, text):
+        try:
+            src = text.encode('ascii')
+        except UnicodeEncodeError:
+            return ''.join(self.apply_into(text, [''] * len(text)))
+        return self.apply_into(src, bytearray(len(src))).decode('ascii')
+
+    def describe(self):
+        return f'permutation, period {self.period}: {self.label}'
+
+
+# ---------------------- NumPy batch backend (optional) ---------------------- #
+# Inputs at least this long go through NumpyBackend when NumPy is installed
+NUMPY_THRESHOLD = 1 << 16
+
+
+class NumpyBackend:
+    """
+    Vectorized versions of the three layers for large inputs.
+
+    Text is viewed as a uint8 array (Latin-1), so every layer is a handful of
+    whole-array operations. Category and shift lookups are built from the
+    layers' own rules, keeping output identical to the scalar path. Methods
+    return None for text outside Latin-1 so callers can fall back.
+    """
+
+    def __init__(self, set_layer, function_layer, graph_layer):
+        codes = range(256)
+        self.print_min = set_layer.PRINT_MIN
+        self.print_range = set_layer.PRINT_RANGE
+        self.block_size = graph_layer.block_size
+        self.permutation = graph_layer.permutation
+        self.inverse_permutation = graph_layer.inverse_permutation
+        self.forward_index = np.array(graph_layer.forward_index, dtype=np.intp)
+        self.inverse_index = np.array(graph_layer.inverse_index, dtype=np.intp)
+        self.a, self.b, self.m = function_layer.a, function_layer.b, function_layer.m
+        self.a_inv = function_layer.a_inv
+        self.offset = function_layer.offset
+        # plaintext byte -> category tag byte / shift
+        categories = [set_layer._category_of(chr(c)) for c in codes]
+        self.tag_of = np.array([ord(cat) for cat in categories], dtype=np.uint8)
+        self.shift_of = np.array([set_layer.shifts[cat] for cat in categories], dtype=np.int64)
+        # tag byte -> shift used when decrypting (unknown tags fall back to 'S')
+        self.unshift_of = np.array(
+            [set_layer.shifts.get(chr(c), set_layer.shifts['S']) for c in codes], dtype=np.int64)
+        self.printable = np.zeros(256, dtype=bool)
+        self.printable[set_layer.PRINT_MIN:set_layer.PRINT_MAX + 1] = True
+
+    @classmethod
+    def supports(cls, function_layer):
+        """Layer 2 must use a code point range whose output fits in a byte."""
+        return (np is not None and function_layer.alphabet is None
+                and function_layer.offset >= 0 and function_layer.offset + function_layer.m <= 256)
+
+    def _to_array(self, text):
+        try:
+            return np.frombuffer(text.encode('latin-1'), dtype=np.uint8)
+        except UnicodeEncodeError:
+            return None
+
+    def _to_text(self, arr):
+        return arr.tobytes().decode('latin-1')
+
+    def _set_encrypt(self, arr):
+        codes = arr.astype(np.int64)
+        # characters outside the printable range are folded into it first
+        idx = np.where(self.printable[arr], codes - self.print_min, codes % self.print_range)
+        out = np.empty(2 * len(arr), dtype=np.uint8)
+        out[0::2] = self.tag_of[arr]
+        out[1::2] = (idx + self.shift_of[arr]) % self.print_range + self.print_min
+        return out
+
+    def _set_decrypt(self, arr):
+        pairs = len(arr) // 2
+        tags, shifted = arr[0:2 * pairs:2], arr[1:2 * pairs:2]
+        idx = shifted.astype(np.int64) - self.print_min - self.unshift_of[tags]
+        out = (idx % self.print_range + self.print_min).astype(np.uint8)
+        if len(arr) % 2:
+            # malformed trailing tag, kept as-is like SetLayer.decrypt does
+            out = np.append(out, arr[-1:])
+        return out
+
+    def _function_encrypt(self, arr):
+        idx = arr.astype(np.int64) - self.offset
+        return ((self.a * idx + self.b) % self.m + self.offset).astype(np.uint8)
+
+    def _function_decrypt(self, arr):
+        idx = arr.astype(np.int64) - self.offset
+        return ((self.a_inv * (idx - self.b)) % self.m + self.offset).astype(np.uint8)
+
+    def _permute(self, arr, index, permutation):
+        full = len(arr) - len(arr) % self.block_size
+        out = np.empty_like(arr)
+        out[:full] = arr[:full].reshape(-1, self.block_size)[:, index].ravel()
+        # ragged final block is permuted on its own
+        out[full:] = arr[full:][permutation.gather(len(arr) - full)]
+        return out
+
+    def _graph_transform(self, arr):
+        return self._permute(arr, self.forward_index, self.permutation)
+
+    def _graph_inverse(self, arr):
+        return self._permute(arr, self.inverse_index, self.inverse_permutation)
+
+    def _apply(self, text, *stages):
+        arr = self._to_array(text)
+        if arr is None:
+            return None
+        for stage in stages:
+            arr = stage(arr)
+        return self._to_text(arr)
+
+    def set_encrypt(self, text):
+        return self._apply(text, self._set_encrypt)
+
+    def function_encrypt(self, text):
+        return self._apply(text, self._function_encrypt)
+
+    def graph_transform(self, text):
+        return self._apply(text, self._graph_transform)
+
+    def graph_inverse(self, text):
+        return self._apply(text, self._graph_inverse)
+
+    def function_decrypt(self, text):
+        return self._apply(text, self._function_decrypt)
+
+    def set_decrypt(self, text):
+        return self._apply(text, self._set_decrypt)
+
+    def encrypt(self, plaintext):
+        return self._apply(plaintext, self._set_encrypt, self._function_encrypt, self._graph_transform)
+
+    def decrypt(self, ciphertext):
+        return self._apply(ciphertext, self._graph_inverse, self._function_decrypt, self._set_decrypt)
+
+class FastPathEngine:
+    """
+    Compiled single-pass engine for a fixed set of layers.
+
+    Layers 1 and 2 are fixed per-character maps, so they are fused into one
+    table from each plaintext character to its two output characters and
+    applied with str.translate; Layer 3 uses the layer's precomputed
+    Permutation. Every table
+    entry is produced by the layers themselves, so the ciphertext is
+    identical to the step-by-step pipeline. No step details are recorded.
+    Inputs of numpy_threshold characters or more use NumpyBackend when
+    NumPy is available.
+    """
+    PRINTABLE = range(SetLayer.PRINT_MIN, SetLayer.PRINT_MAX + 1)
+
+    def __init__(self, set_layer, function_layer, graph_layer, numpy_threshold=NUMPY_THRESHOLD):
+        self.block_size = graph_layer.block_size
+        self.permutation = graph_layer.permutation
+        self.inverse_permutation = graph_layer.inverse_permutation
+        self.numpy_threshold = numpy_threshold
+        self.numpy_backend = None
+        if NumpyBackend.supports(function_layer):
+            self.numpy_backend = NumpyBackend(set_layer, function_layer, graph_layer)
+        self.set_table = _LookupTable(
+            lambda code: set_layer.encrypt(chr(code))[0],
+            self.PRINTABLE)
+        self.function_table = _LookupTable(
+            lambda code: function_layer.encrypt(chr(code))[0],
+            self.PRINTABLE)
+        self.encrypt_table = _LookupTable(
+            lambda code: self.set_table[code].translate(self.function_table),
+            self.PRINTABLE)
+        self.inverse_function_table = _LookupTable(
+            lambda code: function_layer.decrypt(chr(code))[0],
+            self.PRINTABLE)
+        # (tag, shifted) pairs, keyed on the two-character string
+        self.pair_table = _LookupTable(
+            lambda pair: set_layer.decrypt(pair)[0],
+            (chr(t) + chr(s) for t in self.PRINTABLE for s in self.PRINTABLE))
+
+    def _vectorized(self, name, text):
+        """Run `name` on the NumPy backend for large inputs, or return None."""
+        if self.numpy_backend is None or len(text) < self.numpy_threshold:
+            return None
+        return getattr(self.numpy_backend, name)(text)
+
+    # Per-layer operations, used when only layer inputs/outputs are needed
+    def set_encrypt(self, text):
+        result = self._vectorized('set_encrypt', text)
+        return text.translate(self.set_table) if result is None else result
+
+    def function_encrypt(self, text):
+        result = self._vectorized('function_encrypt', text)
+        return text.translate(self.function_table) if result is None else result
+
+    def graph_transform(self, text):
+        result = self._vectorized('graph_transform', text)
+        return self.permutation.apply(text) if result is None else result
+
+    def graph_inverse(self, text):
+        result = self._vectorized('graph_inverse', text)
+        return self.inverse_permutation.apply(text) if result is None else result
+
+    def function_decrypt(self, text):
+        result = self._vectorized('function_decrypt', text)
+        return text.translate(self.inverse_function_table) if result is None else result
+
+    def set_decrypt(self, text):
+        result = self._vectorized('set_decrypt', text)
+        if result is not None:
+            return result
+        plaintext = ''.join(map(self.pair_table.__getitem__, map(str.__add__, text[0::2], text[1::2])))
+        if len(text) % 2:
+            # malformed trailing tag, kept as-is like SetLayer.decrypt does
+            plaintext += text[-1]
+        return plaintext
+
+    def encrypt(self, plaintext):
+        result = self._vectorized('encrypt', plaintext)
+        if result is not None:
+            return result
+        return self.permutation.apply(plaintext.translate(self.encrypt_table))
+
+    def decrypt(self, ciphertext):
+        result = self._vectorized('decrypt', ciphertext)
+        if result is not None:
+            return result
+        return self.set_decrypt(self.function_decrypt(self.graph_inverse(ciphertext)))
+
+# ---------------------- Streaming helpers ---------------------- #
+# Upper bound (in input characters) on each piece processed by the stream API
+STREAM_CHUNK_SIZE = 1 << 20
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _stream_aligned(chunks, transform, unit, chunk_size):
+    """Apply `transform` to a stream of text chunks in pieces of whole units.
+
+    Every piece handed to `transform` (except possibly the last) is a
+    multiple of `unit` characters, so block boundaries inside each piece
+    line up with those of the whole text and the concatenated output equals
+    transform(''.join(chunks)). At most about chunk_size + unit characters
+    are buffered at any time.
+    """
+    chunk_size = max(unit, chunk_size - chunk_size % unit)
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= chunk_size:
+            piece, pending = pending[:chunk_size], pending[chunk_size:]
+            yield transform(piece)
+        aligned = len(pending) - len(pending) % unit
+        if aligned:
+            piece, pending = pending[:aligned], pending[aligned:]
+            yield transform(piece)
+    if pending:
+        # ragged tail: final partial block (and unpaired tag when decrypting)
+        yield transform(pending)
+
+
+def _aligned_units(block_size):
+    """Input characters per aligned unit as (plaintext, ciphertext).
+
+    Layer 1 doubles the length, so Layer 3 blocks line up with plaintext
+    positions only every lcm(2, block_size) / 2 characters; ciphertext
+    must also keep Layer 1 (tag, char) pairs together.
+    """
+    lcm = 2 * block_size // _gcd(2, block_size)
+    return lcm // 2, lcm
+
+
+def _read_chunks(path, chunk_size):
+    # newline='' keeps line endings exactly as stored, so files round-trip
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _write_chunks(path, chunks):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+# ---------------------- Keys ---------------------- #
+@dataclass(frozen=True)
+class CipherKey:
+    """
+    Parameters of one CipherMesh configuration, e.g. a per-tenant key.
+    Hashable, so compiled ciphers can be cached per key. `order` is the
+    Layer 3 block order (see GraphLayer); None reverses each block.
+    """
+    shifts: tuple = tuple(SetLayer.DEFAULT_SHIFTS.items())
+    a: int = 3
+    b: int = 7
+    block_size: int = 4
+    order: tuple = None
+
+    def __post_init__(self):
+        shifts = dict(self.shifts)
+        if set(shifts) != set(SetLayer.DEFAULT_SHIFTS):
+            raise ValueError("shifts must define exactly the categories V, C, D and S")
+        values = list(shifts.values()) + [self.a, self.b, self.block_size]
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            raise ValueError("shifts, 'a', 'b' and 'block_size' must be integers")
+        if _gcd(self.a, FunctionLayer.M) != 1:
+            raise ValueError(f"'a' must be coprime to {FunctionLayer.M} (got {self.a})")
+        if self.block_size < 1:
+            raise ValueError("'block_size' must be at least 1")
+        if self.order is not None:
+            order = tuple(self.order)
+            if (not all(isinstance(i, int) and not isinstance(i, bool) for i in order)
+                    or sorted(order) != list(range(self.block_size))):
+                raise ValueError("'order' must be a permutation of 0..block_size-1")
+            object.__setattr__(self, 'order', order)
+        # normalise shift order so equal keys hash equally
+        object.__setattr__(self, 'shifts', tuple(sorted(shifts.items())))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a key from its JSON form; missing fields use the defaults."""
+        if not isinstance(data, dict):
+            raise ValueError("key must be an object")
+        unknown = set(data) - {'shifts', 'a', 'b', 'block_size', 'order'}
+        if unknown:
+            raise ValueError(f"unknown key fields: {', '.join(sorted(unknown))}")
+        fields = dict(data)
+        if 'shifts' in fields:
+            if not isinstance(fields['shifts'], dict):
+                raise ValueError("shifts must be an object")
+            fields['shifts'] = tuple(fields['shifts'].items())
+        if fields.get('order') is not None:
+            if not isinstance(fields['order'], list):
+                raise ValueError("order must be an array")
+            fields['order'] = tuple(fields['order'])
+        return cls(**fields)
+
+    def to_dict(self):
+        data = {'shifts': dict(self.shifts), 'a': self.a, 'b': self.b, 'block_size': self.block_size}
+        if self.order is not None:
+            data['order'] = list(self.order)
+        return data
+
+
+class KeyCache:
+    """
+    LRU cache of compiled CipherMesh instances, one per CipherKey.
+
+    Compiling a key (validating 'a', computing its inverse, building the
+    fast path tables) happens once per key while it stays cached.
+    """
+
+    def __init__(self, maxsize=128, executor=None):
+        self.maxsize = maxsize
+        # optional process pool shared by every cached cipher
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._ciphers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the compiled CipherMesh for `key`, compiling it on a miss."""
+        with self._lock:
+            cipher = self._ciphers.get(key)
+            if cipher is not None:
+                self._ciphers.move_to_end(key)
+                self.hits += 1
+                return cipher
+            self.misses += 1
+        # compile outside the lock; a concurrent miss on the same key just
+        # compiles twice and keeps one result
+        cipher = CipherMesh(key, executor=self.executor)
+        with self._lock:
+            self._ciphers[key] = cipher
+            self._ciphers.move_to_end(key)
+            while len(self._ciphers) > self.maxsize:
+                self._ciphers.popitem(last=False)
+        return cipher
+
+    def clear(self):
+        with self._lock:
+            self._ciphers.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._ciphers),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# ---------------------- Bytes mode ---------------------- #
+class ByteCipher:
+    """
+    The CipherMesh pipeline over raw bytes, with a 256-symbol alphabet.
+
+    Nothing is folded into the printable range, so any byte string
+    round-trips exactly. Layer 1 classifies ASCII vowels, consonants and
+    digits (every other byte is a symbol) and shifts mod 256, Layer 2 is
+    f(x) = (a*x + b) mod 256 (so 'a' must be odd) and Layer 3 permutes
+    blocks in the key's order. Layers 1 and 2 run as bytes.translate tables and Layer 3 as
+    strided slice copies, so no Python object is created per byte.
+    """
+    M = 256
+
+    def __init__(self, key=None):
+        self.key = CipherKey() if key is None else key
+        set_layer = SetLayer(shifts=dict(self.key.shifts))
+        function_layer = FunctionLayer(a=self.key.a, b=self.key.b, m=self.M, offset=0)
+        forward, inverse = function_layer._forward, function_layer._inverse
+        self.block_size = self.key.block_size
+        graph_layer = GraphLayer(self.key.block_size, self.key.order)
+        self.permutation = graph_layer.permutation
+        self.inverse_permutation = graph_layer.inverse_permutation
+
+        categories = [set_layer._category_of(chr(c)) if c < 128 else 'S' for c in range(self.M)]
+        # Layers 1 and 2 fused: byte -> encrypted tag, byte -> encrypted shifted byte
+        self._tag_table = bytes(forward[ord(cat)] for cat in categories)
+        self._shift_table = bytes(
+            forward[(c + set_layer.shifts[cat]) % self.M] for c, cat in enumerate(categories))
+
+        # Decryption picks, per tag, the unshifted byte through a 0x00/0xFF
+        # mask; unknown tags use the 'S' shift like SetLayer.decrypt does
+        tags = {ord(cat): cat for cat in set_layer.shifts}
+        tag_of = [tags.get(inverse[c], 'S') for c in range(self.M)]
+        self._decrypt_tables = [
+            (bytes((inverse[c] - shift) % self.M for c in range(self.M)),
+             bytes(0xFF if tag_of[c] == cat else 0 for c in range(self.M)))
+            for cat, shift in set_layer.shifts.items()
+        ]
+
+    def _output_view(self, out, size):
+        view = memoryview(out).cast('B')
+        if view.readonly:
+            raise TypeError("output buffer must be writable")
+        if len(view) < size:
+            raise ValueError(f"output buffer too small: need {size} bytes, got {len(view)}")
+        return view[:size]
+
+    def encrypt_into(self, data, out):
+        """Encrypt bytes-like `data` into the writable buffer `out`.
+
+        `out` must hold at least 2 * len(data) bytes; returns the number of
+        bytes written.
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        size = 2 * len(data)
+        tagged = bytearray(size)
+        tagged[0::2] = data.translate(self._tag_table)
+        tagged[1::2] = data.translate(self._shift_table)
+        with self._output_view(out, size) as view:
+            self.permutation.apply_into(tagged, view)
+        return size
+
+    def decrypt_into(self, data, out):
+        """Decrypt bytes-like `data` into `out` (at least len(data) // 2 bytes).
+
+        Returns the number of bytes written.
+        """
+        if len(data) % 2:
+            raise ValueError("ciphertext length must be even in bytes mode")
+        size = len(data) // 2
+        tagged = self.inverse_permutation.apply_into(data, bytearray(len(data)))
+        tags, shifted = tagged[0::2], tagged[1::2]
+        # select per position with big-int bitwise ops instead of a byte loop
+        plain = 0
+        for unshift, mask in self._decrypt_tables:
+            plain |= (int.from_bytes(shifted.translate(unshift), 'little')
+                      & int.from_bytes(tags.translate(mask), 'little'))
+        with self._output_view(out, size) as view:
+            view[:] = plain.to_bytes(size, 'little')
+        return size
+
+    def encrypt(self, data):
+        """Return the ciphertext of bytes-like `data` as a new bytearray."""
+        out = bytearray(2 * len(data))
+        self.encrypt_into(data, out)
+        return out
+
+    def decrypt(self, data):
+        """Return the plaintext of bytes-like `data` as a new bytearray."""
+        out = bytearray(len(data) // 2)
+        self.decrypt_into(data, out)
+        return out
+
+    def _map_file(self, src_path, dst_path, transform_into, unit, ratio, chunk_size):
+        """Stream src_path through transform_into via mmap into dst_path.
+
+        Chunks are whole multiples of `unit` bytes and share one
+        preallocated output buffer of ratio * chunk_size bytes.
+        """
+        chunk_size = max(unit, chunk_size - chunk_size % unit)
+        with open(src_path, 'rb') as src:
+            size = os.fstat(src.fileno()).st_size
+            with open(dst_path, 'wb') as dst:
+                if not size:
+                    return
+                out = bytearray(int(chunk_size * ratio))
+                with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                        memoryview(mapped) as view, memoryview(out) as out_view:
+                    for start in range(0, size, chunk_size):
+                        with view[start:start + chunk_size] as piece:
+                            written = transform_into(piece, out)
+                        dst.write(out_view[:written])
+
+    def encrypt_file(self, src_path, dst_path, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt the file at src_path byte-for-byte into dst_path."""
+        unit, _ = _aligned_units(self.block_size)
+        self._map_file(src_path, dst_path, self.encrypt_into, unit, 2, chunk_size)
+
+    def decrypt_file(self, src_path, dst_path, chunk_size=STREAM_CHUNK_SIZE):
+        """Decrypt a bytes-mode ciphertext file into dst_path."""
+        if os.path.getsize(src_path) % 2:
+            raise ValueError("ciphertext length must be even in bytes mode")
+        _, unit = _aligned_units(self.block_size)
+        self._map_file(src_path, dst_path, self.decrypt_into, unit, 0.5, chunk_size)
+
+# ---------------------- Legacy terminal ciphertexts ---------------------- #
+class LegacyCipher:
+    """
+    Decrypts ciphertexts of the original terminal cipher, which had no
+    category tags and applied f(x) = (a*x + b) mod 128 to raw code points,
+    so every layer kept the length. Its Layer 1 is ambiguous; the original
+    rule (first set whose unshifted character belongs to it, else symbol)
+    is kept so old ciphertexts decrypt exactly as they used to.
+    """
+    M = 128
+    # (shift, members) in the order the original decryption tried them
+    SET_RULES = (
+        (5, frozenset("AEIOUaeiou")),
+        (3, frozenset("BCDFGHJKLMNPQRSTVWXYZcdfghjklmnpqrstvwxyz")),
+        (2, frozenset("0123456789")),
+    )
+    SYMBOL_SHIFT = 1
+
+    def __init__(self, a=3, b=7, block_size=4):
+        self.function_layer = FunctionLayer(a=a, b=b, m=self.M, offset=0)
+        self.block_size = block_size
+        # Layers 2 and 1 fused per character, like FastPathEngine.encrypt_table
+        self.table = _LookupTable(self._decrypt_code, range(self.M))
+
+    def _decrypt_code(self, code):
+        code = ord(self.function_layer.decrypt(chr(code))[0])
+        for shift, members in self.SET_RULES:
+            candidate = chr((code - shift) % self.M)
+            if candidate in members:
+                return candidate
+        return chr((code - self.SYMBOL_SHIFT) % self.M)
+
+    def decrypt(self, ciphertext):
+        return _reverse_blocks(ciphertext, self.block_size).translate(self.table)
+
+    def decrypt_stream(self, chunks, chunk_size=STREAM_CHUNK_SIZE):
+        """Decrypt an iterable of ciphertext chunks, yielding plaintext chunks."""
+        return _stream_aligned(chunks, self.decrypt, self.block_size, chunk_size)
+
+# ---------------------- Parallel execution ---------------------- #
+# Inputs (or batches) with fewer characters than this stay single-threaded,
+# where process pool IPC would cost more than it saves
+PARALLEL_THRESHOLD = 1 << 22
+
+
+@functools.lru_cache(maxsize=32)
+def _worker_cipher(key):
+    """Compiled cipher for `key` inside a worker process (built once)."""
+    return CipherMesh(key)
+
+
+def _encrypt_piece(key, text):
+    return _worker_cipher(key).encrypt(text)
+
+
+def _decrypt_piece(key, text):
+    return _worker_cipher(key).decrypt(text)
+
+
+def keyed_call(key, method, *args, **kwargs):
+    """Call CipherMesh(key).<method>(*args, **kwargs) on this process's cached cipher.
+
+    Picklable entry point for submitting whole requests to a process pool.
+    """
+    return getattr(_worker_cipher(key), method)(*args, **kwargs)
+
+
+def create_executor(workers=None):
+    """Create a process pool for CipherMesh(executor=...) / KeyCache.
+
+    The resource tracker is started first so forked workers share it with
+    this process; otherwise each worker would track (and at exit try to
+    unlink) the shared memory blocks it attaches to.
+    """
+    resource_tracker.ensure_running()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _attach_shared(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _bytes_piece(key, method, src_name, dst_name, start, stop, out_start, out_stop):
+    """Run ByteCipher.<method> on one slice of a shared memory block."""
+    src = _attach_shared(src_name)
+    dst = _attach_shared(dst_name)
+    try:
+        with src.buf[start:stop] as piece, dst.buf[out_start:out_stop] as out:
+            getattr(_worker_cipher(key).byte_cipher, method)(piece, out)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _split_aligned(length, unit, parts):
+    """Split range(length) into about `parts` (start, stop) pieces on unit boundaries."""
+    step = -(-length // parts)
+    step = max(unit, step + (-step) % unit)
+    return [(start, min(start + step, length)) for start in range(0, length, step)]
+
+# ---------------------- Compact wire format ---------------------- #
+# Header: magic, format version, reserved flags, plaintext length. Version 1
+# is followed by the Layer 1 tags packed four per byte (2 bits each, first
+# tag in the high bits) and then the Layer 2+3 output of the shifted
+# characters, one byte each: about 1.25x the plaintext instead of 2x.
+# The version byte is not printable, so text ciphertexts never match.
+COMPACT_MAGIC = b'CM'
+COMPACT_VERSION = 1
+COMPACT_HEADER = struct.Struct('>2sBBQ')
+COMPACT_TAGS = b'VCDS'
+_TAG_CODES = bytes.maketrans(COMPACT_TAGS, bytes(range(len(COMPACT_TAGS))))
+_TAG_LETTERS = bytes.maketrans(bytes(range(len(COMPACT_TAGS))), COMPACT_TAGS)
+
+
+def _pack_tags(codes):
+    """Pack 2-bit codes (one per byte) four per byte.
+
+    Each code is < 4, so shifting the whole lane as one big integer never
+    carries into the neighbouring byte.
+    """
+    codes = bytes(codes) + bytes(-len(codes) % 4)
+    size = len(codes) // 4
+    packed = 0
+    for shift, lane in zip((6, 4, 2, 0), range(4)):
+        packed |= int.from_bytes(codes[lane::4], 'big') << shift
+    return packed.to_bytes(size, 'big')
+
+
+def _unpack_tags(packed, count):
+    """Inverse of _pack_tags, returning `count` codes."""
+    value = int.from_bytes(packed, 'big')
+    mask = int.from_bytes(b'\x03' * len(packed), 'big')
+    codes = bytearray(4 * len(packed))
+    for shift, lane in zip((6, 4, 2, 0), range(4)):
+        codes[lane::4] = ((value >> shift) & mask).to_bytes(len(packed), 'big')
+    return bytes(codes[:count])
+
+
+def is_compact(ciphertext):
+    """True if ciphertext (bytes-like) starts with a compact format header.
+
+    Any non-printable version byte counts, so decrypt_compact can reject
+    versions it does not know instead of decrypting them as text.
+    """
+    head = bytes(ciphertext[:3])
+    return (len(head) == 3 and head[:2] == COMPACT_MAGIC
+            and not SetLayer.PRINT_MIN <= head[2] <= SetLayer.PRINT_MAX)
+
+# ---------------------- Incremental re-encryption ---------------------- #
+@dataclass(frozen=True)
+class CiphertextPatch:
+    """
+    Splice turning an old ciphertext into a new one:
+    new = old[:offset] + text + old[offset + length:].
+    """
+    offset: int
+    length: int
+    text: str
+
+    def apply(self, ciphertext):
+        return ciphertext[:self.offset] + self.text + ciphertext[self.offset + self.length:]
+
+    def to_dict(self):
+        return {'offset': self.offset, 'length': self.length, 'text': self.text}
+
+# ---------------------- Composable pipelines ---------------------- #
+def _map_width(layer):
+    """Output characters per input character of a per-character layer."""
+    return 2 if isinstance(layer, SetLayer) else 1
+
+
+def _layer_label(layer):
+    if isinstance(layer, SetLayer):
+        return f"set{dict(sorted(layer.shifts.items()))}"
+    if isinstance(layer, FunctionLayer):
+        return f'affine({layer.a}x+{layer.b} mod {layer.m})'
+    if layer.order == tuple(range(layer.block_size - 1, -1, -1)):
+        return f'blocks({layer.block_size})'
+    return f"blocks({layer.block_size}; {','.join(map(str, layer.order))})"
+
+
+class _MapStage:
+    """
+    Consecutive per-character layers fused into one translate table.
+
+    When each character becomes several (Layer 1), the table is also split
+    into one single-character table per output position: translating with
+    those stays on str.translate's fast ASCII path, and the results are
+    interleaved with strided slice copies.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.width = functools.reduce(lambda width, layer: width * _map_width(layer), layers, 1)
+        self.table = _LookupTable(self._compute, FastPathEngine.PRINTABLE)
+        self.lanes = [_LookupTable(lambda code, k=k: self.table[code][k], FastPathEngine.PRINTABLE)
+                      for k in range(self.width)] if self.width > 1 else []
+
+    def _compute(self, code):
+        text = chr(code)
+        for layer in self.layers:
+            text, _ = layer.encrypt(text)
+        return text
+
+    def apply(self, text):
+        if not self.lanes:
+            return text.translate(self.table)
+        try:
+            lanes = [text.translate(lane).encode('ascii') for lane in self.lanes]
+        except UnicodeEncodeError:
+            return text.translate(self.table)
+        out = bytearray(len(text) * self.width)
+        for k, lane in enumerate(lanes):
+            out[k::self.width] = lane
+        return out.decode('ascii')
+
+    def inverse(self):
+        return _InverseMapStage(self.layers)
+
+    def describe(self):
+        return f"map: {' -> '.join(map(_layer_label, self.layers))}"
+
+
+class _InverseMapStage:
+    """
+    Inverse of a _MapStage, in as few passes as there are Layer 1 layers.
+
+    Each SetLayer's tag pairs are decoded with one table keyed on the
+    two-character string, with the inverse per-character layers that come
+    before it in decryption order folded in; inverse layers after the last
+    SetLayer become one translate table.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.passes = []
+        pending = []
+        for layer in reversed(layers):
+            if isinstance(layer, SetLayer):
+                self.passes.append((_LookupTable(functools.partial(self._decode, pending + [layer]),
+                                                 (chr(t) + chr(s) for t in FastPathEngine.PRINTABLE
+                                                  for s in FastPathEngine.PRINTABLE)),
+                                    functools.partial(self._decode, pending + [layer])))
+                pending = []
+            else:
+                pending.append(layer)
+        if pending:
+            self.passes.append((_LookupTable(lambda code, layers=pending: self._decode(layers, chr(code)),
+                                             FastPathEngine.PRINTABLE), None))
+
+    @staticmethod
+    def _decode(layers, text):
+        for layer in layers:
+            text, _ = layer.decrypt(text)
+        return text
+
+    def apply(self, text):
+        for table, decode in self.passes:
+            if decode is None:
+                text = text.translate(table)
+                continue
+            decoded = ''.join(map(table.__getitem__, map(str.__add__, text[0::2], text[1::2])))
+            if len(text) % 2:
+                # malformed trailing tag, kept as-is like SetLayer.decrypt does
+                decoded += decode(text[-1])
+            text = decoded
+        return text
+
+    def describe(self):
+        return f"inverse map: {' -> '.join(map(_layer_label, reversed(self.layers)))}"
+
+
+def _build_layer(spec):
+    """A layer instance from a Pipeline spec (or the instance itself)."""
+    if isinstance(spec, (SetLayer, FunctionLayer, GraphLayer)):
+        return spec
+    if not isinstance(spec, dict) or 'layer' not in spec:
+        raise ValueError("each layer spec must be a layer or an object with a 'layer' field")
+    kind, options = spec['layer'], {k: v for k, v in spec.items() if k != 'layer'}
+    if kind == 'set':
+        if set(options) - {'shifts'}:
+            raise ValueError(f"unknown set layer fields: {', '.join(sorted(set(options) - {'shifts'}))}")
+        shifts = options.get('shifts')
+        if shifts is not None:
+            shifts = dict(CipherKey(shifts=tuple(shifts.items())).shifts)
+        return SetLayer(shifts)
+    if kind == 'function':
+        unknown = set(options) - {'a', 'b', 'm', 'offset', 'alphabet'}
+        if unknown:
+            raise ValueError(f"unknown function layer fields: {', '.join(sorted(unknown))}")
+        return FunctionLayer(**options)
+    if kind == 'graph':
+        if set(options) - {'block_size', 'order'}:
+            raise ValueError(f"unknown graph layer fields: {', '.join(sorted(set(options) - {'block_size', 'order'}))}")
+        block_size = options.get('block_size', 4)
+        if not isinstance(block_size, int) or block_size < 1:
+            raise ValueError("'block_size' must be at least 1")
+        return GraphLayer(block_size, options.get('order'))
+    raise ValueError(f"unknown layer {kind!r}; expected 'set', 'function' or 'graph'")
+
+
+class Pipeline:
+    """
+    An ordered list of layers, compiled into as few passes as possible.
+
+    Layers are given as instances or specs such as {'layer': 'set',
+    'shifts': {...}}, {'layer': 'function', 'a': 3, 'b': 7} and
+    {'layer': 'graph', 'block_size': 4[, 'order': [...]]}. Before running, the optimizer
+
+    - moves per-character layers ahead of block permutations (they
+      commute; a permutation behind Layer 1 then moves whole tag pairs),
+    - collapses adjacent affine maps over the same range into one,
+      a2*(a1*x+b1)+b2 = (a2*a1)x + (a2*b1+b2),
+    - fuses all per-character layers into one lookup table, and
+    - composes all block permutations into one precomputed Permutation
+      (dropped when they cancel out).
+
+    Encryption is then one translate pass plus at most one permutation,
+    whatever the depth. Decryption runs the inverse plan. Ciphertexts
+    whose length is not a multiple of `unit` (which the optimized plan
+    cannot have produced) fall back to undoing each layer in turn, so
+    malformed input decrypts exactly as with the unoptimized pipeline.
+    """
+
+    def __init__(self, layers, optimize=True):
+        self.layers = [_build_layer(spec) for spec in layers]
+        if not self.layers:
+            raise ValueError("a pipeline needs at least one layer")
+        self.optimized = optimize
+        # ciphertext lengths the plan's inverse handles exactly are multiples of this
+        self.unit = 1
+        self.plan = self._optimized_plan() if optimize else self._layered_plan()
+        self.inverse_plan = [stage.inverse() for stage in reversed(self.plan)]
+
+    @classmethod
+    def from_key(cls, key=None, optimize=True):
+        """The CipherMesh pipeline for a CipherKey (same ciphertext as CipherMesh(key))."""
+        key = CipherKey() if key is None else key
+        return cls([{'layer': 'set', 'shifts': dict(key.shifts)},
+                    {'layer': 'function', 'a': key.a, 'b': key.b},
+                    {'layer': 'graph', 'block_size': key.block_size, 'order': key.order}], optimize)
+
+    def _layered_plan(self):
+        """One stage per layer, in the given order."""
+        return [layer.permutation if isinstance(layer, GraphLayer) else _MapStage([layer])
+                for layer in self.layers]
+
+    def _optimized_plan(self):
+        maps, permutations = [], []
+        for layer in self.layers:
+            if isinstance(layer, GraphLayer):
+                permutations.append(layer.permutation)
+                continue
+            width = _map_width(layer)
+            if width > 1 and permutations:
+                # this layer now runs before the permutations seen so far
+                permutations = [p.scaled(width) for p in permutations]
+                self.unit *= width
+            previous = maps[-1] if maps else None
+            if (isinstance(layer, FunctionLayer) and isinstance(previous, FunctionLayer)
+                    and layer.alphabet is None and previous.alphabet is None
+                    and (layer.m, layer.offset) == (previous.m, previous.offset)):
+                maps[-1] = FunctionLayer(a=layer.a * previous.a % layer.m,
+                                         b=(layer.a * previous.b + layer.b) % layer.m,
+                                         m=layer.m, offset=layer.offset)
+            else:
+                maps.append(layer)
+
+        plan = [_MapStage(maps)] if maps else []
+        if permutations:
+            permutation = functools.reduce(Permutation.then, permutations)
+            if not permutation.is_identity():
+                plan.append(permutation)
+        return plan
+
+    def describe(self):
+        """Human-readable encryption plan, one line per pass."""
+        return [stage.describe() for stage in self.plan]
+
+    def encrypt(self, plaintext):
+        for stage in self.plan:
+            plaintext = stage.apply(plaintext)
+        return plaintext
+
+    def decrypt(self, ciphertext):
+        if len(ciphertext) % self.unit:
+            # a length the optimized plan cannot produce; undo layer by layer
+            for layer in reversed(self.layers):
+                ciphertext, _ = layer.decrypt(ciphertext)
+            return ciphertext
+        for stage in self.inverse_plan:
+            ciphertext = stage.apply(ciphertext)
+        return ciphertext
+
 
 # ---------------------- Main CipherMesh System ---------------------- #
+# Detail levels for encrypt_with_details / decrypt_with_details:
+# - none:    ciphertext/plaintext only, computed on the fast path
+# - summary: per-layer input/output plus the first SUMMARY_STEPS steps/blocks
+# - full:    every step and block
+DETAIL_NONE = 'none'
+DETAIL_SUMMARY = 'summary'
+DETAIL_FULL = 'full'
+DETAIL_LEVELS = (DETAIL_NONE, DETAIL_SUMMARY, DETAIL_FULL)
+SUMMARY_STEPS = 50
+# Trace formats: a dict per step/block, or TraceColumns per layer
+TRACE_ROWS = 'rows'
+TRACE_COLUMNS = 'columns'
+TRACE_FORMATS = (TRACE_ROWS, TRACE_COLUMNS)
+
+
+# Step (or block) records per 'steps'/'blocks' record of a streamed trace
+STREAM_TRACE_UNITS = 256
+
+
+class TraceObserver:
+    """
+    Receives the records of CipherMesh.trace, one method per record type
+    (see iter_encrypt_details). All methods do nothing by default, so
+    subclasses only override what they display; the cipher itself never
+    does any I/O.
+    """
+    def start(self, record):
+        pass
+
+    def layer(self, record):
+        pass
+
+    def steps(self, record):
+        pass
+
+    def blocks(self, record):
+        pass
+
+    def result(self, record):
+        pass
+
+
+def _items_key(layer_method):
+    """Name of the list of per-unit records a layer method returns."""
+    return 'blocks' if isinstance(layer_method.__self__, GraphLayer) else 'steps'
+
+
+def _columns_method(layer_method):
+    """The layer's columnar counterpart of a bound encrypt/decrypt method."""
+    return getattr(layer_method.__self__, f'{layer_method.__name__}_columns')
+
+
+def _layer_name(layer_method):
+    """Metric name of a bound layer method, e.g. 'SetLayer.encrypt'."""
+    return f'{type(layer_method.__self__).__name__}.{layer_method.__name__}'
+
+
 class CipherMesh:
-    def __init__(self):
-        self.set_layer = SetLayer()
-        self.function_layer = FunctionLayer()
-        self.graph_layer = GraphLayer()
+    """
+    The three-layer pipeline for one key.
+
+    With workers=N (or a shared `executor`), inputs and batches of at least
+    parallel_threshold characters are split on block-aligned boundaries and
+    processed on a ProcessPoolExecutor; results are reassembled in order.
+    """
+
+    def __init__(self, key=None, workers=None, executor=None, parallel_threshold=PARALLEL_THRESHOLD):
+        self.key = CipherKey() if key is None else key
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self._executor = executor
+        self._owns_executor = executor is None and workers is not None
+        self.set_layer = SetLayer(shifts=dict(self.key.shifts))
+        self.function_layer = FunctionLayer(a=self.key.a, b=self.key.b)
+        self.graph_layer = GraphLayer(block_size=self.key.block_size, order=self.key.order)
+        self.fast_path = FastPathEngine(self.set_layer, self.function_layer, self.graph_layer)
+        self._byte_cipher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the process pool if this instance created it."""
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _parallel_executor(self, size):
+        """Executor to use for `size` characters of work, or None to stay serial."""
+        if size < self.parallel_threshold or (self._executor is None and not self._owns_executor):
+            return None
+        if self._executor is None:
+            self._executor = create_executor(self.workers)
+        return self._executor
+
+    def _parts(self, executor):
+        return 4 * (self.workers or getattr(executor, '_max_workers', None) or os.cpu_count() or 1)
+
+    def _map_text(self, piece_fn, serial_fn, text, unit):
+        executor = self._parallel_executor(len(text))
+        if executor is None:
+            return serial_fn(text)
+        bounds = _split_aligned(len(text), unit, self._parts(executor))
+        pieces = executor.map(piece_fn, [self.key] * len(bounds), [text[a:b] for a, b in bounds])
+        return ''.join(pieces)
+
+    def _map_bytes(self, method, data, unit, ratio):
+        """Run a ByteCipher *_into method across the pool through shared memory."""
+        size = len(data)
+        out_size = int(size * ratio)
+        executor = self._parallel_executor(size)
+        if executor is None:
+            out = bytearray(out_size)
+            getattr(self.byte_cipher, method)(data, out)
+            return out
+        src = shared_memory.SharedMemory(create=True, size=max(1, size))
+        dst = shared_memory.SharedMemory(create=True, size=max(1, out_size))
+        try:
+            src.buf[:size] = data
+            futures = [
+                executor.submit(_bytes_piece, self.key, method, src.name, dst.name,
+                                start, stop, int(start * ratio), int(stop * ratio))
+                for start, stop in _split_aligned(size, unit, self._parts(executor))
+            ]
+            for future in futures:
+                future.result()
+            return bytearray(dst.buf[:out_size])
+        finally:
+            src.close()
+            src.unlink()
+            dst.close()
+            dst.unlink()
+
+    @property
+    def byte_cipher(self):
+        """Bytes-mode engine for this key, built on first use."""
+        if self._byte_cipher is None:
+            self._byte_cipher = ByteCipher(self.key)
+        return self._byte_cipher
+
+    @METRICS.timed('pipeline', arg=1)
+    def encrypt(self, plaintext):
+        """Encrypt using the fused fast path (no processing details)."""
+        unit, _ = _aligned_units(self.graph_layer.block_size)
+        return self._map_text(_encrypt_piece, self.fast_path.encrypt, plaintext, unit)
+
+    @METRICS.timed('pipeline', arg=1)
+    def decrypt(self, ciphertext):
+        """Decrypt using the fused fast path (no processing details)."""
+        _, unit = _aligned_units(self.graph_layer.block_size)
+        return self._map_text(_decrypt_piece, self.fast_path.decrypt, ciphertext, unit)
+
+    def encrypt_many(self, plaintexts):
+        """Encrypt a batch of texts, in order, across the pool when it is large."""
+        plaintexts = list(plaintexts)
+        executor = self._parallel_executor(sum(map(len, plaintexts)))
+        if executor is None:
+            return [self.fast_path.encrypt(text) for text in plaintexts]
+        chunksize = max(1, len(plaintexts) // self._parts(executor))
+        return list(executor.map(_encrypt_piece, [self.key] * len(plaintexts), plaintexts, chunksize=chunksize))
+
+    def decrypt_many(self, ciphertexts):
+        """Decrypt a batch of texts, in order, across the pool when it is large."""
+        ciphertexts = list(ciphertexts)
+        executor = self._parallel_executor(sum(map(len, ciphertexts)))
+        if executor is None:
+            return [self.fast_path.decrypt(text) for text in ciphertexts]
+        chunksize = max(1, len(ciphertexts) // self._parts(executor))
+        return list(executor.map(_decrypt_piece, [self.key] * len(ciphertexts), ciphertexts, chunksize=chunksize))
+
+    @METRICS.timed('pipeline', arg=1)
+    def encrypt_edit(self, plaintext, start, end, replacement, ciphertext=None):
+        """Patch for the ciphertext of `plaintext` after replacing plaintext[start:end].
+
+        Layers 1 and 2 map each character to its own two output characters,
+        so only Layer 3 blocks overlapping the edit change - unless the
+        length change is not a whole number of blocks, which shifts the
+        alignment of everything after it. Only those blocks are encrypted.
+        The previous `ciphertext`, when given, must match the encryption of
+        `plaintext` over the replaced window, or ValueError is raised.
+        """
+        if not 0 <= start <= end <= len(plaintext):
+            raise ValueError("edit range must satisfy 0 <= start <= end <= len(plaintext)")
+        if ciphertext is not None and len(ciphertext) != 2 * len(plaintext):
+            raise ValueError("ciphertext does not match plaintext length")
+        block_size = self.graph_layer.block_size
+        edited = plaintext[:start] + replacement + plaintext[end:]
+        old_length, new_length = 2 * len(plaintext), 2 * len(edited)
+        delta = new_length - old_length
+
+        # Layer 1 output positions of the first changed character and of the
+        # first character after the edit, in the old text
+        offset = 2 * start // block_size * block_size
+        if delta % block_size == 0:
+            # later blocks keep their alignment and content: re-encrypt up to the
+            # end of the block holding the old edit's end
+            old_end = min(-(-2 * end // block_size) * block_size, old_length)
+            new_end = old_end + delta
+        else:
+            old_end, new_end = old_length, new_length
+
+        def window(text, stop):
+            # Layers 1+2 of the characters covering [offset, stop), trimmed to that
+            # range, then Layer 3 on block boundaries aligned with the full text
+            first = offset // 2
+            intermediate = text[first:-(-stop // 2)].translate(self.fast_path.encrypt_table)
+            return self.fast_path.graph_transform(intermediate[offset - 2 * first:stop - 2 * first])
+
+        if ciphertext is not None and ciphertext[offset:old_end] != window(plaintext, old_end):
+            raise ValueError("ciphertext does not match plaintext")
+        return CiphertextPatch(offset, old_end - offset, window(edited, new_end))
+
+    def encrypt_compact(self, plaintext):
+        """Encrypt into the compact wire format (bytes, see COMPACT_HEADER).
+
+        Layer 1 tags travel in a packed side channel; Layers 2 and 3 run on
+        the shifted characters only. decrypt_compact(encrypt_compact(t)) == t
+        for every t that round-trips through encrypt/decrypt.
+        """
+        tagged = self.fast_path.set_encrypt(plaintext)
+        body = self.fast_path.graph_transform(self.fast_path.function_encrypt(tagged[1::2]))
+        tags = _pack_tags(tagged[0::2].encode('ascii').translate(_TAG_CODES))
+        header = COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, 0, len(plaintext))
+        return header + tags + body.encode('ascii')
+
+    def decrypt_compact(self, data):
+        """Decrypt compact-format bytes back to the plaintext string."""
+        data = memoryview(data)
+        if len(data) < COMPACT_HEADER.size:
+            raise ValueError("compact ciphertext is truncated")
+        magic, version, _, length = COMPACT_HEADER.unpack_from(data)
+        if magic != COMPACT_MAGIC:
+            raise ValueError("not a compact ciphertext")
+        if version != COMPACT_VERSION:
+            raise ValueError(f"unsupported compact format version {version}")
+        tag_size = -(-length // 4)
+        if len(data) != COMPACT_HEADER.size + tag_size + length:
+            raise ValueError("compact ciphertext length does not match its header")
+
+        tags = _unpack_tags(data[COMPACT_HEADER.size:COMPACT_HEADER.size + tag_size], length)
+        body = bytes(data[COMPACT_HEADER.size + tag_size:]).decode('ascii')
+        shifted = self.fast_path.function_decrypt(self.fast_path.graph_inverse(body))
+        # rebuild the tagged Layer 1 text and undo it with the usual pair table
+        tagged = bytearray(2 * length)
+        tagged[0::2] = tags.translate(_TAG_LETTERS)
+        tagged[1::2] = shifted.encode('ascii')
+        return self.fast_path.set_decrypt(tagged.decode('ascii'))
 
-    def encrypt_with_details(self, plaintext):
-        """Encrypt with detailed processing information."""
+    def decrypt_any(self, ciphertext):
+        """Decrypt compact bytes or a (str or ASCII bytes) text ciphertext."""
+        if isinstance(ciphertext, str):
+            return self.decrypt(ciphertext)
+        if is_compact(ciphertext):
+            return self.decrypt_compact(ciphertext)
+        return self.decrypt(bytes(ciphertext).decode('ascii'))
+
+    @METRICS.timed('pipeline', arg=1)
+    def encrypt_bytes(self, data):
+        """Encrypt bytes/bytearray/memoryview exactly (see ByteCipher)."""
+        unit, _ = _aligned_units(self.graph_layer.block_size)
+        return self._map_bytes('encrypt_into', data, unit, 2)
+
+    @METRICS.timed('pipeline', arg=1)
+    def decrypt_bytes(self, data):
+        """Decrypt a bytes-mode ciphertext back to the original bytes."""
+        if len(data) % 2:
+            raise ValueError("ciphertext length must be even in bytes mode")
+        _, unit = _aligned_units(self.graph_layer.block_size)
+        return self._map_bytes('decrypt_into', data, unit, 0.5)
+
+    def encrypt_stream(self, chunks, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt an iterable of plaintext chunks, yielding ciphertext chunks.
+
+        Memory use is bounded by chunk_size regardless of the total length,
+        and the joined output equals encrypt(''.join(chunks)).
+        """
+        unit, _ = _aligned_units(self.graph_layer.block_size)
+        return _stream_aligned(chunks, self.fast_path.encrypt, unit, chunk_size)
+
+    def decrypt_stream(self, chunks, chunk_size=STREAM_CHUNK_SIZE):
+        """Decrypt an iterable of ciphertext chunks, yielding plaintext chunks."""
+        _, unit = _aligned_units(self.graph_layer.block_size)
+        return _stream_aligned(chunks, self.fast_path.decrypt, unit, chunk_size)
+
+    def encrypt_file(self, src_path, dst_path, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt the UTF-8 text file at src_path into dst_path."""
+        _write_chunks(dst_path, self.encrypt_stream(_read_chunks(src_path, chunk_size), chunk_size))
+
+    def decrypt_file(self, src_path, dst_path, chunk_size=STREAM_CHUNK_SIZE):
+        """Decrypt the ciphertext file at src_path into dst_path."""
+        _write_chunks(dst_path, self.decrypt_stream(_read_chunks(src_path, chunk_size), chunk_size))
+
+    def _check_detail(self, detail):
+        if detail not in DETAIL_LEVELS:
+            raise ValueError(f"detail must be one of {', '.join(DETAIL_LEVELS)}")
+
+    def _check_trace_format(self, trace_format):
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError(f"trace_format must be one of {', '.join(TRACE_FORMATS)}")
+
+    def _trace(self, layer_method, fast_method, text, unit, detail, trace_format=TRACE_ROWS):
+        """Run one layer and return (output, steps, total step count).
+
+        With summary detail the output comes from the fast path and steps are
+        only traced for the first SUMMARY_STEPS units of `unit` characters.
+        Columnar traces are always derived from fast path outputs.
+        """
+        total = -(-len(text) // unit)
+        start = time.perf_counter() if METRICS.enabled else None
+        try:
+            if trace_format == TRACE_COLUMNS:
+                output = fast_method(text)
+                traced = text if detail == DETAIL_FULL else text[:SUMMARY_STEPS * unit]
+                steps = _columns_method(layer_method)(traced, output if traced is text else fast_method(traced))
+            elif detail == DETAIL_FULL:
+                output, steps = layer_method(text)
+            else:
+                output = fast_method(text)
+                _, steps = layer_method(text[:SUMMARY_STEPS * unit])
+        except Exception:
+            METRICS.error('layer', _layer_name(layer_method))
+            raise
+        if start is not None:
+            METRICS.observe('layer', _layer_name(layer_method), time.perf_counter() - start,
+                            len(text), len(output))
+        return output, steps, total
+
+    def _encrypt_stages(self):
+        """Encryption layers in order as (layer_method, fast_method, unit, record).
+
+        `record` holds the static part of the layer's details entry; the key
+        of its step list ('steps' or 'blocks') is the last field added.
+        """
+        function_layer = self.function_layer
+        return [
+            (self.set_layer.encrypt, self.fast_path.set_encrypt, 1,
+             {'name': 'Layer 1: Set Classification Shift (Tagged)'}),
+            (function_layer.encrypt, self.fast_path.function_encrypt, 1,
+             {'name': 'Layer 2: Mathematical Substitution',
+              'formula': f'f(x) = ({function_layer.a}x + {function_layer.b}) mod {function_layer.m}'}),
+            (self.graph_layer.encrypt, self.fast_path.graph_transform, self.graph_layer.block_size,
+             {'name': 'Layer 3: Graph Transformation (Block Reversal)' if self.key.order is None
+              else 'Layer 3: Graph Transformation (Block Permutation)'}),
+        ]
+
+    def _decrypt_stages(self):
+        """Decryption layers in order, like _encrypt_stages."""
+        function_layer = self.function_layer
+        return [
+            (self.graph_layer.decrypt, self.fast_path.graph_inverse, self.graph_layer.block_size,
+             {'name': 'Reversing Layer 3: Graph Transformation'}),
+            (function_layer.decrypt, self.fast_path.function_decrypt, 1,
+             {'name': 'Reversing Layer 2: Inverse Function',
+              'formula': f'f⁻¹(y) = ({function_layer.a_inv}×(y-{function_layer.b})) mod {function_layer.m}'}),
+            # now unambiguous with tags
+            (self.set_layer.decrypt, self.fast_path.set_decrypt, 2,
+             {'name': 'Reversing Layer 1: Set Classification Shift (Tagged)'}),
+        ]
+
+    def _with_details(self, stages, text, input_key, output_key, detail, trace_format):
         details = {
-            'plaintext': plaintext,
-            'length': len(plaintext),
+            input_key: text,
+            'length': len(text),
+            'detail': detail,
             'layers': []
         }
-        
-        # Layer 1: Set Layer
-        set_encrypted, set_steps = self.set_layer.encrypt(plaintext)
-        details['layers'].append({
-            'name': 'Layer 1: Set Classification Shift (Tagged)',
-            'input': plaintext,
-            'output': set_encrypted,
-            'steps': set_steps
-        })
-        
-        # Layer 2: Function Layer
-        function_encrypted, function_steps = self.function_layer.encrypt(set_encrypted)
-        details['layers'].append({
-            'name': 'Layer 2: Mathematical Substitution',
-            'input': set_encrypted,
-            'output': function_encrypted,
-            'steps': function_steps,
-            'formula': f'f(x) = ({self.function_layer.a}x + {self.function_layer.b}) mod {self.function_layer.m}'
-        })
-        
-        # Layer 3: Graph Layer
-        graph_encrypted, graph_blocks = self.graph_layer.encrypt(function_encrypted)
-        details['layers'].append({
-            'name': 'Layer 3: Graph Transformation (Block Reversal)',
-            'input': function_encrypted,
-            'output': graph_encrypted,
-            'blocks': graph_blocks
-        })
-        
+        for layer_method, fast_method, unit, record in stages:
+            output, items, total = self._trace(layer_method, fast_method, text, unit, detail, trace_format)
+            items_key = _items_key(layer_method)
+            details['layers'].append(dict(record, input=text, output=output,
+                                          **{items_key: items, f'total_{items_key}': total}))
+            text = output
         return {
-            'ciphertext': graph_encrypted,
+            output_key: text,
             'details': details
         }
 
-    def decrypt_with_details(self, ciphertext, set_layer_rules=None):
+    @METRICS.timed('pipeline', arg=1, result_key='ciphertext')
+    def encrypt_with_details(self, plaintext, detail=DETAIL_FULL, trace_format=TRACE_ROWS):
+        """Encrypt with detailed processing information.
+
+        Args:
+            plaintext: The text to encrypt
+            detail: One of DETAIL_LEVELS; with 'none' no details are built
+            trace_format: One of TRACE_FORMATS; with 'columns' each layer's
+                steps/blocks are a TraceColumns instead of a list of dicts
+        """
+        self._check_detail(detail)
+        self._check_trace_format(trace_format)
+        if detail == DETAIL_NONE:
+            return {
+                'ciphertext': self.encrypt(plaintext),
+                'details': None
+            }
+        return self._with_details(self._encrypt_stages(), plaintext, 'plaintext', 'ciphertext', detail,
+                                  trace_format)
+
+    @METRICS.timed('pipeline', arg=1, result_key='plaintext')
+    def decrypt_with_details(self, ciphertext, set_layer_rules=None, detail=DETAIL_FULL, trace_format=TRACE_ROWS):
         """Decrypt with detailed processing information.
         
         Args:
             ciphertext: The encrypted text to decrypt
             set_layer_rules: Deprecated - no longer needed with tagged approach
+            detail: One of DETAIL_LEVELS; with 'none' no details are built
+            trace_format: One of TRACE_FORMATS, as for encrypt_with_details
         """
-        details = {
-            'ciphertext': ciphertext,
-            'length': len(ciphertext),
-            'layers': []
-        }
-        
-        # Layer 3: Graph Layer (reverse)
-        graph_decrypted, graph_blocks = self.graph_layer.decrypt(ciphertext)
-        details['layers'].append({
-            'name': 'Reversing Layer 3: Graph Transformation',
-            'input': ciphertext,
-            'output': graph_decrypted,
-            'blocks': graph_blocks
-        })
-        
-        # Layer 2: Function Layer (reverse)
-        function_decrypted, function_steps = self.function_layer.decrypt(graph_decrypted)
-        details['layers'].append({
-            'name': 'Reversing Layer 2: Inverse Function',
-            'input': graph_decrypted,
-            'output': function_decrypted,
-            'steps': function_steps,
-            'formula': f'f⁻¹(y) = ({self.function_layer.a_inv}×(y-{self.function_layer.b})) mod {self.function_layer.m}'
-        })
-        
-        # Layer 1: Set Layer (reverse) - now unambiguous with tags
-        set_decrypted, set_steps = self.set_layer.decrypt(function_decrypted)
-        details['layers'].append({
-            'name': 'Reversing Layer 1: Set Classification Shift (Tagged)',
-            'input': function_decrypted,
-            'output': set_decrypted,
-            'steps': set_steps
-        })
-        
-        return {
-            'plaintext': set_decrypted,
-            'details': details
-        }
+        self._check_detail(detail)
+        self._check_trace_format(trace_format)
+        if detail == DETAIL_NONE:
+            return {
+                'plaintext': self.decrypt(ciphertext),
+                'details': None
+            }
+        return self._with_details(self._decrypt_stages(), ciphertext, 'ciphertext', 'plaintext', detail,
+                                  trace_format)
+
+    def _iter_details(self, stages, text, mode, output_key, detail, trace_format):
+        yield {'type': 'start', 'mode': mode, 'length': len(text), 'detail': detail}
+        if detail == DETAIL_NONE:
+            text = self.encrypt(text) if mode == 'encrypt' else self.decrypt(text)
+        for index, (layer_method, fast_method, unit, record) in enumerate(stages if detail != DETAIL_NONE else ()):
+            start = time.perf_counter() if METRICS.enabled else None
+            output = fast_method(text)
+            items_key = _items_key(layer_method)
+            traced = len(text) if detail == DETAIL_FULL else min(len(text), SUMMARY_STEPS * unit)
+            yield dict(record, type='layer', index=index, input=text, output=output,
+                       **{f'total_{items_key}': -(-len(text) // unit)})
+            # trace aligned slices so only one batch of step records is alive at a time
+            step = STREAM_TRACE_UNITS * unit
+            for offset in range(0, traced, step):
+                piece = text[offset:min(offset + step, traced)]
+                if trace_format == TRACE_COLUMNS:
+                    items = _columns_method(layer_method)(piece, fast_method(piece))
+                else:
+                    _, items = layer_method(piece)
+                yield {'type': items_key, 'index': index, items_key: items}
+            if start is not None:
+                METRICS.observe('layer', _layer_name(layer_method), time.perf_counter() - start,
+                                len(text), len(output))
+            text = output
+        yield {'type': 'result', output_key: text}
+
+    def iter_encrypt_details(self, plaintext, detail=DETAIL_FULL, trace_format=TRACE_ROWS):
+        """Encrypt, yielding the trace as a sequence of small records.
+
+        Records, in order: 'start'; per layer a 'layer' header (name,
+        input, output, totals) followed by 'steps' or 'blocks' records of at
+        most STREAM_TRACE_UNITS entries (a TraceColumns with 'columns'
+        trace_format); and finally 'result'. Only one batch of step records
+        is built at a time, so memory does not grow with the trace.
+        """
+        self._check_detail(detail)
+        self._check_trace_format(trace_format)
+        return self._iter_details(self._encrypt_stages(), plaintext, 'encrypt', 'ciphertext', detail,
+                                  trace_format)
+
+    def iter_decrypt_details(self, ciphertext, detail=DETAIL_FULL, trace_format=TRACE_ROWS):
+        """Decrypt, yielding the trace records like iter_encrypt_details."""
+        self._check_detail(detail)
+        self._check_trace_format(trace_format)
+        return self._iter_details(self._decrypt_stages(), ciphertext, 'decrypt', 'plaintext', detail,
+                                  trace_format)
+
+    def trace(self, operation, text, observer, detail=DETAIL_FULL):
+        """Run 'encrypt' or 'decrypt' on text, passing each trace record to
+        the matching TraceObserver method as it is produced; returns the result.
+        """
+        if operation == 'encrypt':
+            records, output_key = self.iter_encrypt_details(text, detail), 'ciphertext'
+        elif operation == 'decrypt':
+            records, output_key = self.iter_decrypt_details(text, detail), 'plaintext'
+        else:
+            raise ValueError("operation must be 'encrypt' or 'decrypt'")
+        for record in records:
+            getattr(observer, record['type'])(record)
+        return record[output_key]
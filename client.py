@@ -0,0 +1,410 @@
+"""
+CipherMesh Client
+
+Python client for the CipherMesh API. Calls share a pool of keep-alive
+HTTP connections, and concurrent encrypt/decrypt calls made within a
+short window are coalesced into one request to the batch endpoints. The
+same interface can run CipherMesh in-process (local mode), skipping the
+network entirely.
+
+Usage:
+    from client import CipherClient, AsyncCipherClient
+
+    with CipherClient('http://localhost:8000') as client:
+        ciphertext = client.encrypt('Hello, World!')
+        plaintexts = client.decrypt_many([ciphertext] * 100)
+
+    async with AsyncCipherClient('http://localhost:8000') as client:
+        ciphertext = await client.encrypt('Hello, World!')
+
+    client = CipherClient(local=True)   # or CIPHERMESH_URL=local
+"""
+
+import asyncio
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from cipher_logic import CipherKey, KeyCache
+
+# Field holding the input text, per operation
+FIELDS = {'encrypt': 'plaintext', 'decrypt': 'ciphertext'}
+# Default cap on a coalesced batch body, well under the server's
+# MAX_BATCH_BYTES (16 MiB) so a full batch is never rejected with 413
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+
+class CipherAPIError(Exception):
+    """A call the server (or local engine) rejected; `status` is the HTTP status when there is one."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to one server, reused across threads.
+
+    At most `size` requests are in flight at once. A reused connection the
+    server has meanwhile closed is replaced and the request sent again.
+    """
+
+    def __init__(self, base_url, size=8, timeout=60):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"unsupported URL scheme {parts.scheme!r}")
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host, self.port = parts.hostname, parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def _connect(self):
+        self.opened += 1
+        return self._connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)."""
+        with self._slots:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            while True:
+                try:
+                    conn.request(method, self.prefix + path, body, headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                    break
+                except (ConnectionError, http.client.HTTPException):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # the server closed an idle keep-alive connection; retry once on a new one
+                    conn, reused = self._connect(), False
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return response.status, response.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _Batch:
+    __slots__ = ('deadline', 'items', 'futures', 'size')
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.items, self.futures = [], []
+        # bytes of the JSON array body holding the items
+        self.size = 2
+
+
+class _Coalescer:
+    """
+    Groups calls submitted within `window` seconds into one batch per operation.
+
+    Items are JSON-encoded bytes. A batch is sent once its window has
+    passed or it holds max_items items; an item that would take the body
+    past max_bytes goes into a new batch. `send(operation, items)` returns
+    one result entry per item; batches are sent on `executor`.
+    """
+
+    def __init__(self, send, executor, window, max_items, max_bytes):
+        self._send = send
+        self._executor = executor
+        self.window = window
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._thread = None
+        self._closed = False
+
+    def submit(self, operation, item):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("client is closed")
+            batch = self._pending.get(operation)
+            if batch is not None and batch.size + 1 + len(item) > self.max_bytes:
+                self._dispatch(operation)
+                batch = None
+            if batch is None:
+                batch = self._pending[operation] = _Batch(time.monotonic() + self.window)
+                self._cond.notify()
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.size += len(item) + (len(batch.items) > 1)
+            if len(batch.items) >= self.max_items or batch.size >= self.max_bytes:
+                self._dispatch(operation)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ciphermesh-coalescer', daemon=True)
+                self._thread.start()
+        return future
+
+    def _dispatch(self, operation):
+        """Hand the pending batch for `operation` to the executor (lock held)."""
+        batch = self._pending.pop(operation)
+        self._executor.submit(self._flush, operation, batch)
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                for operation in [op for op, batch in self._pending.items() if batch.deadline <= now]:
+                    self._dispatch(operation)
+                if self._pending:
+                    self._cond.wait(min(batch.deadline for batch in self._pending.values()) - now)
+
+    def _flush(self, operation, batch):
+        try:
+            entries = self._send(operation, batch.items)
+        except BaseException as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, entry in zip(batch.futures, entries):
+            if entry.get('success'):
+                future.set_result(entry['result'])
+            else:
+                future.set_exception(CipherAPIError(entry.get('error', 'batch item failed'), 400))
+
+    def close(self):
+        """Send whatever is pending and stop the window thread."""
+        with self._cond:
+            self._closed = True
+            for operation in list(self._pending):
+                self._dispatch(operation)
+            self._cond.notify()
+
+
+class CipherClient:
+    """
+    Thread-safe CipherMesh client.
+
+    encrypt/decrypt calls go through submit(): texts of up to
+    coalesce_max_chars characters are coalesced for `window` seconds (0
+    disables coalescing) into /api/<operation>/batch requests whose body
+    stays under max_batch_bytes; longer texts are sent to /api/<operation>
+    on their own. Requests rejected by
+    the server's admission control (429/503) are retried up to `retries`
+    times after their Retry-After delay. With local=True every call runs
+    on an in-process CipherMesh (one per key) in the calling thread.
+    `key` is a CipherKey or its dict form and can be overridden per call.
+    """
+
+    def __init__(self, base_url=None, key=None, local=False, pool_size=8, timeout=60,
+                 window=0.002, max_batch=256, coalesce_max_chars=1 << 16,
+                 max_batch_bytes=MAX_BATCH_BYTES, retries=2):
+        if base_url is None and not local:
+            raise ValueError("base_url is required unless local=True")
+        self.local = local
+        self.key = key
+        self.retries = retries
+        self.coalesce_max_chars = coalesce_max_chars
+        self.max_batch_bytes = max_batch_bytes
+        if local:
+            self._ciphers = KeyCache()
+            return
+        self.pool = ConnectionPool(base_url, size=pool_size, timeout=timeout)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='ciphermesh-client')
+        self._coalescer = None
+        if window > 0:
+            self._coalescer = _Coalescer(self._send_batch, self._executor, window, max_batch,
+                                         max_bytes=max_batch_bytes)
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Client for CIPHERMESH_URL; the value 'local' selects local mode."""
+        url = os.environ.get('CIPHERMESH_URL', 'http://localhost:8000')
+        if url == 'local':
+            return cls(local=True, **kwargs)
+        return cls(url, **kwargs)
+
+    # ---- transport ----
+    def _key_dict(self, key):
+        key = self.key if key is None else key
+        return key.to_dict() if isinstance(key, CipherKey) else key
+
+    def _post(self, path, payload):
+        return self._post_body(path, json.dumps(payload).encode('utf-8'))
+
+    def _post_body(self, path, body):
+        """POST a JSON body and return the decoded response, retrying 429/503 after Retry-After."""
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        for attempt in range(self.retries + 1):
+            status, response_headers, data = self.pool.request('POST', path, body, headers)
+            if status == 200:
+                return json.loads(data)
+            try:
+                message = json.loads(data).get('error', data.decode('utf-8', 'replace'))
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            retry_after = response_headers.get('Retry-After')
+            retry_after = float(retry_after) if retry_after else None
+            if status not in (429, 503) or attempt == self.retries:
+                raise CipherAPIError(message, status, retry_after)
+            time.sleep(retry_after or 1)
+
+    def _send_batch(self, operation, items):
+        # items arrive JSON-encoded, so the body is just their array
+        return self._post_body(f'/api/{operation}/batch', b'[' + b','.join(items) + b']')['results']
+
+    def _send_one(self, operation, payload):
+        return self._post(f'/api/{operation}', payload)['result']
+
+    def _cipher(self, key):
+        key = self.key if key is None else key
+        try:
+            if isinstance(key, dict):
+                key = CipherKey.from_dict(key)
+            return self._ciphers.get(key or CipherKey())
+        except ValueError as e:
+            raise CipherAPIError(str(e), 400) from None
+
+    # ---- calls ----
+    def submit(self, operation, text, key=None):
+        """Start encrypting or decrypting `text`; returns a concurrent.futures.Future of the result."""
+        if operation not in FIELDS:
+            raise ValueError("operation must be 'encrypt' or 'decrypt'")
+        if not text:
+            # the API rejects empty input; its result is empty either way
+            future = Future()
+            future.set_result('')
+            return future
+        if self.local:
+            future = Future()
+            try:
+                future.set_result(getattr(self._cipher(key), operation)(text))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        item = {FIELDS[operation]: text}
+        key = self._key_dict(key)
+        if key is not None:
+            item['key'] = key
+        if self._coalescer is not None and len(text) <= self.coalesce_max_chars:
+            encoded = json.dumps(item).encode('utf-8')
+            # escapes can make a short text long on the wire
+            if len(encoded) + 2 <= self.max_batch_bytes:
+                return self._coalescer.submit(operation, encoded)
+        return self._executor.submit(self._send_one, operation, dict(item, detail='none'))
+
+    def encrypt(self, plaintext, key=None):
+        return self.submit('encrypt', plaintext, key).result()
+
+    def decrypt(self, ciphertext, key=None):
+        return self.submit('decrypt', ciphertext, key).result()
+
+    def encrypt_many(self, plaintexts, key=None):
+        """Encrypt several texts at once (they share batches); results in input order."""
+        return [future.result() for future in [self.submit('encrypt', text, key) for text in plaintexts]]
+
+    def decrypt_many(self, ciphertexts, key=None):
+        return [future.result() for future in [self.submit('decrypt', text, key) for text in ciphertexts]]
+
+    def _with_details(self, operation, text, detail, key, trace_format):
+        if self.local:
+            method = getattr(self._cipher(key), f'{operation}_with_details')
+            result = method(text, detail=detail, trace_format=trace_format)
+            return {'result': result['ciphertext' if operation == 'encrypt' else 'plaintext'],
+                    'details': result['details']}
+        payload = {FIELDS[operation]: text, 'detail': detail, 'trace_format': trace_format}
+        key = self._key_dict(key)
+        if key is not None:
+            payload['key'] = key
+        response = self._post(f'/api/{operation}', payload)
+        return {'result': response['result'], 'details': response['details']}
+
+    def encrypt_with_details(self, plaintext, detail='full', key=None, trace_format='rows'):
+        """{'result', 'details'} as served by /api/encrypt (never coalesced).
+
+        In local mode 'columns' details are TraceColumns objects rather
+        than their JSON form.
+        """
+        return self._with_details('encrypt', plaintext, detail, key, trace_format)
+
+    def decrypt_with_details(self, ciphertext, detail='full', key=None, trace_format='rows'):
+        return self._with_details('decrypt', ciphertext, detail, key, trace_format)
+
+    def close(self):
+        """Send pending calls, wait for them and close the pooled connections."""
+        if self.local:
+            return
+        if self._coalescer is not None:
+            self._coalescer.close()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncCipherClient:
+    """
+    asyncio interface to CipherClient (same arguments).
+
+    Coalesced calls are awaited without tying up a thread each, so many
+    concurrent coroutines share a few batched requests. *_with_details
+    calls, and local-mode calls on long texts, run in the default executor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.client = CipherClient(*args, **kwargs)
+
+    async def _call(self, operation, text, key):
+        client = self.client
+        if client.local and len(text) > client.coalesce_max_chars:
+            # keep long in-process runs off the event loop
+            return await asyncio.to_thread(getattr(client, operation), text, key)
+        return await asyncio.wrap_future(client.submit(operation, text, key))
+
+    async def encrypt(self, plaintext, key=None):
+        return await self._call('encrypt', plaintext, key)
+
+    async def decrypt(self, ciphertext, key=None):
+        return await self._call('decrypt', ciphertext, key)
+
+    async def encrypt_many(self, plaintexts, key=None):
+        return list(await asyncio.gather(*(self.encrypt(text, key) for text in plaintexts)))
+
+    async def decrypt_many(self, ciphertexts, key=None):
+        return list(await asyncio.gather(*(self.decrypt(text, key) for text in ciphertexts)))
+
+    async def encrypt_with_details(self, plaintext, detail='full', key=None, trace_format='rows'):
+        return await asyncio.to_thread(self.client.encrypt_with_details, plaintext, detail, key, trace_format)
+
+    async def decrypt_with_details(self, ciphertext, detail='full', key=None, trace_format='rows'):
+        return await asyncio.to_thread(self.client.decrypt_with_details, ciphertext, detail, key, trace_format)
+
+    async def aclose(self):
+        await asyncio.to_thread(self.client.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,37 @@
+"""
+Gunicorn settings for serving CipherMesh in production:
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker process builds its own app via create_app(). Threaded workers
+keep small requests moving while large payloads wait on the cipher process
+pool (CIPHERMESH_CIPHER_WORKERS). Tunable through the environment.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('CIPHERMESH_BIND', '0.0.0.0:8000')
+
+# concurrency
+workers = int(os.environ.get('CIPHERMESH_WEB_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('CIPHERMESH_THREADS', 8))
+backlog = int(os.environ.get('CIPHERMESH_BACKLOG', 2048))
+keepalive = 5
+
+# graceful shutdown: in-flight requests get this long after SIGTERM
+graceful_timeout = int(os.environ.get('CIPHERMESH_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('CIPHERMESH_TIMEOUT', 60))
+
+# request line/header limits; body size is MAX_CONTENT_LENGTH in the app
+limit_request_line = 8190
+limit_request_fields = 100
+
+
+def worker_exit(server, worker):
+    """Stop the cipher process pool of an exiting worker."""
+    app = getattr(worker, 'wsgi', None)
+    service = getattr(app, 'extensions', {}).get('ciphermesh') if app else None
+    if service is not None:
+        service.shutdown()
@@ -0,0 +1,189 @@
+"""
+CipherMesh Metrics
+
+Lightweight in-process instrumentation: per (kind, name) call and error
+counts, input/output sizes and latency histograms, exported as a Python
+snapshot or in the Prometheus text format. Recording is one flag check
+per call when disabled.
+"""
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Series:
+    __slots__ = ('calls', 'errors', 'size_in', 'size_out', 'latency_sum', 'buckets')
+
+    def __init__(self):
+        self.calls = self.errors = self.size_in = self.size_out = 0
+        self.latency_sum = 0.0
+        # one count per bucket plus the +Inf overflow bucket
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def quantile(self, q):
+        """Estimate a latency quantile by interpolating inside its bucket."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Registry:
+    """Thread-safe collection of metric series keyed by (kind, name)."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name):
+        series = self._series.get((kind, name))
+        if series is None:
+            series = self._series[(kind, name)] = _Series()
+        return series
+
+    def observe(self, kind, name, seconds, size_in=0, size_out=0):
+        """Record one call that took `seconds`."""
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._get(kind, name)
+            series.calls += 1
+            series.size_in += size_in
+            series.size_out += size_out
+            series.latency_sum += seconds
+            series.buckets[index] += 1
+
+    def error(self, kind, name):
+        """Record one failed call."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._get(kind, name).errors += 1
+
+    def timed(self, kind, name=None, arg=0, result_key=None):
+        """Decorator recording latency and len() of args[arg] and the result.
+
+        With result_key the output size is taken from result[result_key].
+        Exceptions are counted as errors and re-raised. When the registry is
+        disabled the wrapped function is called directly.
+        """
+        def decorator(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    self.error(kind, label)
+                    raise
+                self.observe(kind, label, time.perf_counter() - start,
+                             _size(args[arg] if len(args) > arg else None),
+                             _size(result if result_key is None else result[result_key]))
+                return result
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """Plain-dict view: {kind: {name: {calls, errors, ..., p50, p95, p99}}}."""
+        with self._lock:
+            items = [(key, series) for key, series in sorted(self._series.items())]
+            snapshot = {}
+            for (kind, name), series in items:
+                entry = {
+                    'calls': series.calls,
+                    'errors': series.errors,
+                    'size_in': series.size_in,
+                    'size_out': series.size_out,
+                    'latency_sum': series.latency_sum,
+                }
+                for q in QUANTILES:
+                    entry[f'p{int(q * 100)}'] = series.quantile(q)
+                snapshot.setdefault(kind, {})[name] = entry
+        return snapshot
+
+    def prometheus(self):
+        """Render every series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            items = sorted(self._series.items())
+
+            def family(metric, kind_, help_text, value_of):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {kind_}')
+                for (kind, name), series in items:
+                    lines.append(f'{metric}{{kind="{kind}",name="{name}"}} {value_of(series)}')
+
+            family('ciphermesh_calls_total', 'counter', 'Completed calls.', lambda s: s.calls)
+            family('ciphermesh_errors_total', 'counter', 'Failed calls.', lambda s: s.errors)
+            family('ciphermesh_input_size_total', 'counter',
+                   'Input size: characters for layers/pipelines, bytes for endpoints.', lambda s: s.size_in)
+            family('ciphermesh_output_size_total', 'counter',
+                   'Output size: characters for layers/pipelines, bytes for endpoints.', lambda s: s.size_out)
+
+            lines.append('# HELP ciphermesh_latency_seconds Call latency.')
+            lines.append('# TYPE ciphermesh_latency_seconds histogram')
+            for (kind, name), series in items:
+                labels = f'kind="{kind}",name="{name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), series.buckets):
+                    cumulative += count
+                    lines.append(f'ciphermesh_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'ciphermesh_latency_seconds_sum{{{labels}}} {series.latency_sum}')
+                lines.append(f'ciphermesh_latency_seconds_count{{{labels}}} {series.calls}')
+
+            lines.append('# HELP ciphermesh_latency_quantile_seconds Latency quantiles estimated from the histogram.')
+            lines.append('# TYPE ciphermesh_latency_quantile_seconds gauge')
+            for (kind, name), series in items:
+                for q in QUANTILES:
+                    lines.append(f'ciphermesh_latency_quantile_seconds{{kind="{kind}",name="{name}",'
+                                 f'quantile="{q}"}} {series.quantile(q)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _size(value):
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+def _env_enabled(name, default=True):
+    # parsed as JSON like the app's CIPHERMESH_* settings, e.g. 'false'
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return bool(json.loads(value))
+    except ValueError:
+        return default
+
+
+# Process-wide registry used by cipher_logic and the web app. Apps never
+# change its flag; CIPHERMESH_METRICS_ENABLED sets it for the whole process.
+REGISTRY = Registry(enabled=_env_enabled('CIPHERMESH_METRICS_ENABLED'))
@@ -0,0 +1,177 @@
+"""
+CipherMesh Result Cache
+
+In-process LRU cache of serialized API results, bounded by entry count and
+total bytes, with a per-entry TTL. An optional SQLite tier lets several
+server processes (e.g. Gunicorn workers) share results.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(operation, cipher_key, detail, payload):
+    """Cache key for one operation on `payload` with a CipherKey and detail level."""
+    digest = hashlib.blake2b(payload.encode('utf-8', 'surrogatepass'), digest_size=20).hexdigest()
+    shifts = ''.join(f'{cat}{shift},' for cat, shift in cipher_key.shifts)
+    order = '' if cipher_key.order is None else ':' + ','.join(map(str, cipher_key.order))
+    return f'{operation}|{detail}|{shifts}{cipher_key.a},{cipher_key.b},{cipher_key.block_size}{order}|{digest}'
+
+
+class SqliteTier:
+    """
+    Results shared between processes through one SQLite file.
+
+    Best effort: database errors (e.g. a lock held too long by another
+    process) count as misses rather than failing the request.
+    """
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.errors = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=0.5, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'key TEXT PRIMARY KEY, value BLOB, size INTEGER, stored REAL, expires REAL)')
+
+    def get(self, key):
+        try:
+            with self._lock:
+                row = self._db.execute('SELECT value, expires FROM results WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            self.errors += 1
+            return None
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        try:
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                 (key, value, len(value), now, expires))
+                self._puts += 1
+                if self._puts % self.PRUNE_EVERY == 0:
+                    self._prune(now)
+        except sqlite3.Error:
+            self.errors += 1
+
+    def _prune(self, now):
+        self._db.execute('DELETE FROM results WHERE expires IS NOT NULL AND expires < ?', (now,))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total > self.max_bytes:
+            # drop the oldest entries until the tier fits again
+            for key, size in self._db.execute('SELECT key, size FROM results ORDER BY stored').fetchall():
+                self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM results')
+
+
+class ResultCache:
+    """
+    LRU cache of serialized results (bytes) with TTL and count/byte bounds.
+
+    Entries larger than max_entry_bytes are not cached, so one huge trace
+    cannot flush everything else. With shared_path, misses fall back to a
+    SqliteTier at that path and stored results are written through to it.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300,
+                 max_entry_bytes=1024 * 1024, shared_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.shared = SqliteTier(shared_path, max_bytes, ttl) if shared_path else None
+        self.hits = self.misses = self.evictions = self.expirations = self.shared_hits = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """Return the cached bytes for `key`, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+                self.expirations += 1
+        value = self.shared.get(key) if self.shared is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._store(key, value, now)
+        return value
+
+    def put(self, key, value):
+        """Cache `value` (bytes) under `key` if it is small enough."""
+        if not self.enabled or len(value) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._store(key, value, time.monotonic())
+        if self.shared is not None:
+            self.shared.put(key, value)
+
+    def _store(self, key, value, now):
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = (now + self.ttl if self.ttl else None, value)
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _discard(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+        if self.shared is not None:
+            stats['shared_hits'] = self.shared_hits
+            stats['shared_errors'] = self.shared.errors
+        return stats
@@ -1,6 +1,23 @@
 // CipherMesh Web Application JavaScript
 
 let currentMode = 'encrypt';
+// Last processed request, so the full trace can be fetched on demand
+let lastRequest = null;
+
+// Steps/blocks the server returns with 'summary' detail (SUMMARY_STEPS)
+const SUMMARY_STEPS = 50;
+
+// Virtualized trace lists: fixed row heights (px, matching style.css),
+// the list viewport height and rows rendered beyond it on each side
+const STEP_ROW_HEIGHT = 40;
+const BLOCK_ROW_HEIGHT = 56;
+const BLOCK_WIDTH = 180;
+const LIST_HEIGHT = 300;
+const OVERSCAN = 10;
+
+// Matrix rain frame function and its timer while running
+let matrixDraw = null;
+let matrixInterval = null;
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
@@ -9,6 +26,20 @@ document.addEventListener('DOMContentLoaded', () => {
     initTerminalTyping();
 });
 
+// Run the rain only while it is visible behind an empty view
+function updateMatrixAnimation() {
+    const resultsShown = document.getElementById('result-section').style.display !== 'none'
+        || document.getElementById('details-section').style.display !== 'none';
+    const shouldRun = matrixDraw !== null && !document.hidden && !resultsShown;
+
+    if (shouldRun && matrixInterval === null) {
+        matrixInterval = setInterval(matrixDraw, 35);
+    } else if (!shouldRun && matrixInterval !== null) {
+        clearInterval(matrixInterval);
+        matrixInterval = null;
+    }
+}
+
 // Matrix-style red rain effect
 function initMatrixEffect() {
     const canvas = document.getElementById('matrix-canvas');
@@ -58,7 +89,9 @@ function initMatrixEffect() {
         }
     }
     
-    setInterval(draw, 35);
+    matrixDraw = draw;
+    updateMatrixAnimation();
+    document.addEventListener('visibilitychange', updateMatrixAnimation);
     
     window.addEventListener('resize', () => {
         canvas.width = window.innerWidth;
@@ -164,49 +197,171 @@ function handleProcess() {
 
     hideResults();
 
-    // Make API call
-    const endpoint = currentMode === 'encrypt' ? '/api/encrypt' : '/api/decrypt';
+    // Make API call; only a summary trace is needed for the initial view
+    lastRequest = { mode: currentMode, text: text, layers: [], fullTrace: null };
+    streamCipher(currentMode, text, 'summary', traceRenderer(lastRequest, true))
+    .catch(error => {
+        showError('Network error: ' + error.message);
+    })
+    .finally(() => {
+        // Hide loading state
+        processBtn.disabled = false;
+        btnText.style.display = 'inline';
+        btnLoader.style.display = 'none';
+    });
+}
+
+// Request an NDJSON trace and pass each record to onRecord as it arrives
+function streamCipher(mode, text, detail, onRecord) {
+    const endpoint = mode === 'encrypt' ? '/api/encrypt' : '/api/decrypt';
     
-    fetch(endpoint, {
+    return fetch(endpoint, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            'Accept': 'application/x-ndjson',
         },
         body: JSON.stringify({
-            [currentMode === 'encrypt' ? 'plaintext' : 'ciphertext']: text
+            [mode === 'encrypt' ? 'plaintext' : 'ciphertext']: text,
+            detail: detail,
+            // compact per-layer columns, expanded by expandTrace
+            trace_format: 'columns'
         })
     })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            showResults(data);
-        } else {
-            showError(data.error || 'An error occurred during processing.');
+    .then(response => {
+        if (!response.ok || !response.body) {
+            // validation errors come back as a single JSON object
+            return response.json().then(data => onRecord({ type: 'error', error: data.error }));
         }
-    })
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        const pump = () => reader.read().then(({ done, value }) => {
+            buffered += decoder.decode(value, { stream: !done });
+            const lines = buffered.split('\n');
+            buffered = done ? '' : lines.pop();
+            lines.forEach(line => {
+                if (line.trim()) onRecord(JSON.parse(line));
+            });
+            if (!done) return pump();
+        });
+        return pump();
+    });
+}
+
+// Stream the full trace into the existing layer boxes (once per request)
+function loadFullDetails() {
+    const request = lastRequest;
+    if (!request || request.fullTrace) return;
+    
+    request.fullTrace = streamCipher(request.mode, request.text, 'full', traceRenderer(request, false))
     .catch(error => {
         showError('Network error: ' + error.message);
-    })
-    .finally(() => {
-        // Hide loading state
-        processBtn.disabled = false;
-        btnText.style.display = 'inline';
-        btnLoader.style.display = 'none';
     });
 }
 
-function showResults(data) {
+// Record handler that renders a streamed trace for `request`; withResult also
+// shows the result text. Records arriving after a newer request are dropped.
+function traceRenderer(request, withResult) {
+    let isSummary = false;
+
+    return record => {
+        if (request !== lastRequest) return;
+
+        switch (record.type) {
+            case 'start':
+                isSummary = record.detail === 'summary';
+                if (record.detail !== 'none' && withResult) resetDetails();
+                break;
+            case 'layer': {
+                const entry = request.layers[record.index];
+                if (entry) {
+                    // full trace replacing a summary: keep the box and scroll position
+                    entry.list.reset(record.total_steps || record.total_blocks || 0);
+                    if (entry.moreInfo) entry.moreInfo.remove();
+                    entry.moreInfo = null;
+                } else {
+                    request.layers[record.index] = createLayerBox(record, record.index, isSummary);
+                    document.getElementById('details-content').appendChild(request.layers[record.index].box);
+                }
+                break;
+            }
+            case 'steps':
+            case 'blocks':
+                request.layers[record.index].list.append(expandTrace(record[record.type]));
+                break;
+            case 'result':
+                if (withResult) showResult(record.ciphertext !== undefined ? record.ciphertext : record.plaintext);
+                break;
+            case 'error':
+                showError(record.error || 'An error occurred during processing.');
+                break;
+        }
+    };
+}
+
+// Expand a columnar trace (TraceColumns.to_dict on the server) into the
+// step/block objects the renderers use. Strings are split by code point so
+// positions line up with the server's characters.
+function expandTrace(trace) {
+    if (Array.isArray(trace)) return trace;
+
+    if (trace.layer === 'graph') {
+        const chars = Array.from(trace.text);
+        const blocks = [];
+        for (let i = 0; i < chars.length; i += trace.block_size) {
+            const block = chars.slice(i, i + trace.block_size);
+            // position j of a block takes block[order[j]]; a ragged last block uses 'tail'
+            const order = block.length === trace.block_size ? trace.order : trace.tail;
+            blocks.push({ original: block.join(''), transformed: order.map(j => block[j]).join('') });
+        }
+        return blocks;
+    }
+
+    const input = Array.from(trace.input);
+    const output = Array.from(trace.output);
+
+    if (trace.layer === 'set') {
+        const shiftOf = cat => Object.prototype.hasOwnProperty.call(trace.shifts, cat) ? trace.shifts[cat] : trace.shifts.S;
+        return Array.from(trace.rule, (cat, i) => {
+            if (trace.mode === 'encrypt') {
+                return { input: input[i], rule: cat, shift: shiftOf(cat), output: cat + output[i] };
+            }
+            if (i === input.length) {
+                // malformed trailing tag
+                return { input: cat, rule: 'Symbol', shift: shiftOf(cat), output: cat };
+            }
+            return { input: cat + input[i], rule: cat, shift: shiftOf(cat), output: output[i] };
+        });
+    }
+
+    // function layer: formulas are rebuilt from the affine key
+    const alphabet = trace.alphabet !== undefined ? Array.from(trace.alphabet) : null;
+    const indexOf = ch => alphabet ? alphabet.indexOf(ch) : ch.codePointAt(0) - trace.offset;
+    return input.map((ch, i) => {
+        const x = indexOf(ch);
+        const y = indexOf(output[i]);
+        const formula = trace.mode === 'encrypt'
+            ? `(${trace.a}×${x}+${trace.b}) mod ${trace.m} = ${y}`
+            : `f⁻¹(${x}) = (${trace.a_inv}×(${x}-${trace.b})) mod ${trace.m} = ${y}`;
+        return {
+            input: ch,
+            input_ascii: ch.codePointAt(0),
+            output: output[i],
+            output_ascii: output[i].codePointAt(0),
+            formula: formula
+        };
+    });
+}
+
+function showResult(resultText) {
     const resultSection = document.getElementById('result-section');
     const resultContent = document.getElementById('result-content');
-    const detailsSection = document.getElementById('details-section');
-    const detailsContent = document.getElementById('details-content');
 
-    // Show result with terminal-style typing effect
-    const resultKey = currentMode === 'encrypt' ? 'result' : 'result';
-    const resultText = data[resultKey];
-    
     resultSection.style.display = 'block';
     resultContent.textContent = '';
+    updateMatrixAnimation();
     
     // Terminal typing effect
     let charIndex = 0;
@@ -219,21 +374,102 @@ function showResults(data) {
     };
     typeResult();
 
-    // Show details
-    if (data.details && data.details.layers) {
-        detailsContent.innerHTML = '';
-        data.details.layers.forEach((layer, index) => {
-            const layerBox = createLayerBox(layer, index);
-            detailsContent.appendChild(layerBox);
-        });
-        detailsSection.style.display = 'block';
-    }
-
     // Scroll to results
     resultSection.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
 }
 
-function createLayerBox(layer, index) {
+function resetDetails() {
+    document.getElementById('details-content').innerHTML = '';
+    document.getElementById('details-section').style.display = 'block';
+    updateMatrixAnimation();
+}
+
+function createMoreInfo(remaining, label, canLoadFull) {
+    const moreInfo = document.createElement('div');
+    moreInfo.style.color = 'var(--text-gray)';
+    moreInfo.style.fontSize = '0.85rem';
+    moreInfo.style.marginTop = '0.5rem';
+    moreInfo.textContent = `... and ${remaining} more ${label} `;
+
+    if (canLoadFull) {
+        const loadBtn = document.createElement('button');
+        loadBtn.className = 'copy-btn';
+        loadBtn.textContent = '[LOAD FULL TRACE]';
+        loadBtn.addEventListener('click', loadFullDetails);
+        moreInfo.appendChild(loadBtn);
+    }
+
+    return moreInfo;
+}
+
+// Windowed list: only the rows in view (plus OVERSCAN) exist in the DOM.
+// Items are appended as they stream in; `total` is the expected item count,
+// and scrolling near the end of the loaded items calls onNeedMore.
+function createVirtualList(options) {
+    const viewport = document.createElement('div');
+    viewport.className = 'layer-steps virtual-list';
+    const spacer = document.createElement('div');
+    spacer.className = 'virtual-spacer';
+    const rows = document.createElement('div');
+    rows.className = 'virtual-rows';
+    spacer.appendChild(rows);
+    viewport.appendChild(spacer);
+
+    const list = { element: viewport, items: [], total: options.total };
+    let rendered = null;
+    let frame = null;
+    let scrolled = false;
+
+    const render = () => {
+        frame = null;
+        const perRow = options.perRow ? options.perRow(viewport) : 1;
+        const count = Math.max(list.items.length, list.total);
+        const rowCount = Math.ceil(count / perRow);
+        spacer.style.height = `${rowCount * options.rowHeight}px`;
+
+        const first = Math.max(0, Math.floor(viewport.scrollTop / options.rowHeight) - OVERSCAN);
+        const last = Math.min(rowCount, Math.ceil((viewport.scrollTop + LIST_HEIGHT) / options.rowHeight) + OVERSCAN);
+        const key = `${first}:${last}:${perRow}:${list.items.length}`;
+        if (key === rendered) return;
+        rendered = key;
+
+        const fragment = document.createDocumentFragment();
+        for (let row = first; row < last; row++) {
+            fragment.appendChild(options.renderRow(list.items.slice(row * perRow, (row + 1) * perRow)));
+        }
+        rows.style.transform = `translateY(${first * options.rowHeight}px)`;
+        rows.replaceChildren(fragment);
+
+        if (scrolled && last * perRow > list.items.length && list.total > list.items.length && options.onNeedMore) {
+            options.onNeedMore();
+        }
+    };
+    const schedule = () => {
+        if (frame === null) frame = requestAnimationFrame(render);
+    };
+
+    viewport.addEventListener('scroll', () => {
+        scrolled = true;
+        schedule();
+    }, { passive: true });
+    // re-flow block rows when the width changes; goes away with the element
+    if (window.ResizeObserver) new ResizeObserver(schedule).observe(viewport);
+    list.append = items => {
+        for (const item of items) list.items.push(item);
+        schedule();
+    };
+    list.reset = total => {
+        list.items = [];
+        list.total = total;
+        rendered = null;
+        schedule();
+    };
+    schedule();
+    return list;
+}
+
+// Build a layer box from its header record; steps/blocks are appended as they stream in
+function createLayerBox(layer, index, isSummary) {
     const layerBox = document.createElement('div');
     layerBox.className = 'layer-box';
     layerBox.style.opacity = '0';
@@ -249,7 +485,7 @@ function createLayerBox(layer, index) {
         layerBox.style.transition = 'all 0.5s ease-out';
         layerBox.style.opacity = '1';
         layerBox.style.transform = 'translateX(0)';
-    }, index * 100);
+    }, 100);
 
     const info = document.createElement('div');
     info.className = 'layer-info';
@@ -260,60 +496,63 @@ function createLayerBox(layer, index) {
     `;
     layerBox.appendChild(info);
 
-    // Add steps for Layer 1 and Layer 2
-    if (layer.steps && layer.steps.length > 0) {
-        const stepsContainer = document.createElement('div');
-        stepsContainer.className = 'layer-steps';
-        
-        // Limit display to first 50 steps to prevent overwhelming UI
-        const displaySteps = layer.steps.slice(0, 50);
-        displaySteps.forEach(step => {
-            const stepItem = createStepItem(step, layer.name);
-            stepsContainer.appendChild(stepItem);
-        });
-        
-        if (layer.steps.length > 50) {
-            const moreInfo = document.createElement('div');
-            moreInfo.style.color = 'var(--text-gray)';
-            moreInfo.style.fontSize = '0.85rem';
-            moreInfo.style.marginTop = '0.5rem';
-            moreInfo.textContent = `... and ${layer.steps.length - 50} more steps`;
-            stepsContainer.appendChild(moreInfo);
-        }
-        
-        layerBox.appendChild(stepsContainer);
-    }
+    const entry = { box: layerBox, list: null, moreInfo: null };
+    const isBlocks = layer.total_blocks !== undefined;
+    const total = isBlocks ? layer.total_blocks : layer.total_steps;
+    if (!total) return entry;
+
+    // Steps for Layers 1 and 2, blocks for Layer 3; with a summary trace the
+    // rest is streamed in when the list is scrolled past the loaded part
+    entry.list = createVirtualList(isBlocks ? {
+        total: total,
+        rowHeight: BLOCK_ROW_HEIGHT,
+        perRow: viewport => Math.max(1, Math.floor(viewport.clientWidth / BLOCK_WIDTH)),
+        renderRow: createBlockRow,
+        onNeedMore: loadFullDetails
+    } : {
+        total: total,
+        rowHeight: STEP_ROW_HEIGHT,
+        renderRow: items => createStepItem(items[0], layer.name),
+        onNeedMore: loadFullDetails
+    });
+    layerBox.appendChild(entry.list.element);
 
-    // Add blocks for Layer 3
-    if (layer.blocks && layer.blocks.length > 0) {
-        const blocksContainer = document.createElement('div');
-        blocksContainer.style.marginTop = '1rem';
-        blocksContainer.style.display = 'flex';
-        blocksContainer.style.flexWrap = 'wrap';
-        blocksContainer.style.gap = '0.5rem';
-        
-        layer.blocks.forEach(block => {
-            const blockItem = document.createElement('div');
-            blockItem.className = 'block-item';
-            blockItem.innerHTML = `
-                <span class="block-original">${escapeHtml(block.original)}</span>
-                <span class="block-arrow">→</span>
-                <span class="block-transformed">${escapeHtml(block.transformed)}</span>
-            `;
-            blocksContainer.appendChild(blockItem);
-        });
-        
-        layerBox.appendChild(blocksContainer);
+    if (isSummary && total > SUMMARY_STEPS) {
+        entry.moreInfo = createMoreInfo(total - SUMMARY_STEPS, isBlocks ? 'blocks' : 'steps', true);
+        layerBox.appendChild(entry.moreInfo);
     }
 
-    return layerBox;
+    return entry;
+}
+
+function createBlockRow(blocks) {
+    const row = document.createElement('div');
+    row.className = 'virtual-row block-row';
+    if (!blocks.length) {
+        // row beyond the part of the trace loaded so far
+        row.textContent = 'loading...';
+    }
+    blocks.forEach(block => {
+        const blockItem = document.createElement('div');
+        blockItem.className = 'block-item';
+        blockItem.innerHTML = `
+            <span class="block-original">${escapeHtml(block.original)}</span>
+            <span class="block-arrow">→</span>
+            <span class="block-transformed">${escapeHtml(block.transformed)}</span>
+        `;
+        row.appendChild(blockItem);
+    });
+    return row;
 }
 
 function createStepItem(step, layerName) {
     const stepItem = document.createElement('div');
-    stepItem.className = 'step-item';
+    stepItem.className = 'step-item virtual-row';
 
-    if (layerName.includes('Layer 1')) {
+    if (!step) {
+        // row beyond the part of the trace loaded so far
+        stepItem.textContent = 'loading...';
+    } else if (layerName.includes('Layer 1')) {
         stepItem.innerHTML = `
             <strong>Input:</strong> '<span style="color: var(--text-white)">${escapeHtml(step.input)}</span>' 
             (${step.rule}) | 
@@ -339,12 +578,14 @@ function showError(message) {
     
     resultContent.innerHTML = `<div class="error-message">${escapeHtml(message)}</div>`;
     resultSection.style.display = 'block';
+    updateMatrixAnimation();
     resultSection.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
 }
 
 function hideResults() {
     document.getElementById('result-section').style.display = 'none';
     document.getElementById('details-section').style.display = 'none';
+    updateMatrixAnimation();
 }
 
 function handleCopy() {